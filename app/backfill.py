@@ -0,0 +1,92 @@
+import asyncio
+
+from app import service
+from settings import REFRESH_BATCH_SIZE, REFRESH_CONCURRENCY
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class BackfillQueue:
+    """
+    Очередь первичной загрузки прогнозов для только что добавленных городов.
+
+    /add_city и /import ставят location_id новых городов в очередь и сразу отвечают, а фоновая задача
+    забирает накопившиеся локации (не больше REFRESH_BATCH_SIZE * REFRESH_CONCURRENCY за раз) и загружает
+    их прогнозы через upd_locations_to_db: пачками по REFRESH_BATCH_SIZE локаций на запрос к api,
+    не более REFRESH_CONCURRENCY запросов одновременно. Локация, которая уже ждёт в очереди или загружается,
+    повторно не ставится. Состояние загрузки по локациям хранится в statuses.
+
+    Если очередь не запущена (приложение без lifespan, например в тестах),
+    загрузка выполняется сразу при постановке
+    """
+
+    def __init__(self):
+        self.statuses = {}
+        self._queue = None
+        self._task = None
+
+    @property
+    def is_running(self):
+        return self._task is not None
+
+    async def start(self):
+        if self._task is None:
+            self._queue = asyncio.Queue()
+            self._task = asyncio.create_task(self._run())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            self._queue = None
+
+    def status(self, location_id):
+        """
+        Состояние загрузки локации или None, если она в эту очередь не ставилась
+        """
+        return self.statuses.get(location_id)
+
+    async def enqueue(self, location_ids):
+        """
+        Ставит локации в очередь, пропуская уже ожидающие или загружаемые
+        """
+        new_ids = [location_id for location_id in dict.fromkeys(location_ids)
+                   if self.statuses.get(location_id) not in (QUEUED, RUNNING)]
+        for location_id in new_ids:
+            self.statuses[location_id] = QUEUED
+
+        if not new_ids:
+            return
+        if self._task is None:
+            await self._process(new_ids)
+            return
+        for location_id in new_ids:
+            self._queue.put_nowait(location_id)
+
+    async def _run(self):
+        while True:
+            batch = [await self._queue.get()]
+            while not self._queue.empty() and len(batch) < REFRESH_BATCH_SIZE * REFRESH_CONCURRENCY:
+                batch.append(self._queue.get_nowait())
+            await self._process(batch)
+
+    async def _process(self, location_ids):
+        for location_id in location_ids:
+            self.statuses[location_id] = RUNNING
+        try:
+            stored = await service.upd_locations_to_db(location_ids)
+        except Exception as e:
+            print(f"Ошибка при загрузке погоды для локаций с ID {location_ids}: {e}")
+            stored = set()
+        for location_id in location_ids:
+            self.statuses[location_id] = DONE if location_id in stored else FAILED
+
+
+backfill = BackfillQueue()
@@ -0,0 +1,89 @@
+import time
+import asyncio
+from collections import OrderedDict
+
+
+class TTLCache:
+    """
+    LRU-кеш в памяти с временем жизни записей и ограничением на число записей.
+
+    Одновременные промахи по одному ключу объединяются в один вызов загрузчика
+    (single-flight). Ошибки загрузчика не кешируются
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def get(self, key):
+        """
+        Возвращает значение по ключу или None, если записи нет или она устарела
+        """
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def get_stale(self, key):
+        """
+        Возвращает значение по ключу, даже если оно устарело (пока запись не вытеснена), или None.
+        Используется, когда свежее значение получить не удалось
+        """
+        entry = self._data.get(key)
+        return entry[1] if entry is not None else None
+
+    def set(self, key, value):
+        """
+        Сохраняет значение и вытесняет самые давно использованные записи сверх maxsize
+        """
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    async def _load(self, key, loader):
+        value = await loader()
+        self.set(key, value)
+        return value
+
+    async def get_or_load(self, key, loader):
+        """
+        Возвращает значение из кеша, а при промахе вызывает loader() один раз
+        для всех одновременных запросов этого ключа
+        """
+        value = self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        task = self._inflight.get(key)
+        if task is None:
+            self.misses += 1
+            task = asyncio.ensure_future(self._load(key, loader))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.coalesced += 1
+        return await asyncio.shield(task)
+
+    def stats(self):
+        """
+        Счётчики попаданий и промахов кеша
+        """
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+        }
@@ -0,0 +1,72 @@
+from datetime import date, datetime
+
+from app import snapshot
+
+
+def current_etag():
+    """
+    ETag данных: поколение данных из БД (одинаковое во всех процессах) и сегодняшняя дата
+    (от неё зависят ответы без явного date)
+    """
+    return f'"{snapshot.generation()}-{date.today():%Y%m%d}"'
+
+
+def etag_matches(if_none_match, etag):
+    """
+    Совпадает ли ETag с одним из перечисленных в заголовке If-None-Match
+    """
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == "*" or candidate == etag:
+            return True
+    return False
+
+
+class ConditionalGetMiddleware:
+    """
+    ASGI middleware для GET-запросов с путём, начинающимся с prefix.
+
+    Успешные ответы получают ETag текущего поколения данных и Cache-Control: max-age
+    до следующего запуска обновления (next_run возвращает его datetime или None).
+    Ответы, которые сами задают Cache-Control (например, статус загрузки), не меняются.
+    Если If-None-Match совпадает с текущим ETag, сразу отвечает 304 без вызова обработчика и обращения к БД
+    """
+
+    def __init__(self, app, prefix, next_run=None):
+        self.app = app
+        self.prefix = prefix
+        self.next_run = next_run
+
+    def max_age(self):
+        next_run = self.next_run() if self.next_run is not None else None
+        if next_run is None:
+            return 0
+        return max(0, int((next_run - datetime.now(next_run.tzinfo)).total_seconds()))
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in ("GET", "HEAD") or not scope["path"].startswith(self.prefix):
+            await self.app(scope, receive, send)
+            return
+
+        etag = current_etag()
+        headers = [
+            (b"etag", etag.encode()),
+            (b"cache-control", f"max-age={self.max_age()}".encode()),
+        ]
+
+        for name, value in scope["headers"]:
+            if name == b"if-none-match" and etag_matches(value.decode("latin-1"), etag):
+                await send({"type": "http.response.start", "status": 304, "headers": headers})
+                await send({"type": "http.response.body", "body": b""})
+                return
+
+        async def send_with_etag(message):
+            if message["type"] == "http.response.start" and message["status"] == 200:
+                response_headers = list(message.get("headers", []))
+                if not any(name == b"cache-control" for name, _ in response_headers):
+                    message["headers"] = response_headers + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_etag)
@@ -1,40 +1,328 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 import aiosqlite
 
+from settings import (DB_ROUTE, LOCATION_PRECISION, DB_POOL_READERS, DB_MMAP_SIZE,
+                      DB_CACHE_SIZE, DB_BUSY_TIMEOUT)
+
+WEATHER_DATA_SCHEMA = '''CREATE TABLE IF NOT EXISTS weather_data (
+                            id INTEGER PRIMARY KEY AUTOINCREMENT,
+                            location_id INTEGER NOT NULL,
+                            timestamp DATETIME NOT NULL,
+                            temperature REAL,
+                            surface_pressure REAL,
+                            wind_speed REAL,
+                            precipitation REAL,
+                            FOREIGN KEY(location_id) REFERENCES locations(id)
+                         )'''
+
+
+WEATHER_HOURLY_SCHEMA = '''CREATE TABLE IF NOT EXISTS weather_hourly (
+                              location_id INTEGER NOT NULL,
+                              timestamp DATETIME NOT NULL,
+                              temperature REAL,
+                              surface_pressure REAL,
+                              wind_speed REAL,
+                              precipitation REAL,
+                              PRIMARY KEY(location_id, timestamp),
+                              FOREIGN KEY(location_id) REFERENCES locations(id)
+                           )'''
+
+
+WEATHER_COLUMNS_SCHEMA = '''CREATE TABLE IF NOT EXISTS weather_columns (
+                               location_id INTEGER NOT NULL,
+                               day DATE NOT NULL,
+                               temperature BLOB,
+                               surface_pressure BLOB,
+                               wind_speed BLOB,
+                               precipitation BLOB,
+                               UNIQUE(location_id, day),
+                               FOREIGN KEY(location_id) REFERENCES locations(id)
+                            )'''
+
+
+# Сколько миллисекунд init_db ждёт, пока другой процесс закончит инициализацию
+# (перевод большой базы в auto_vacuum через VACUUM может идти долго)
+INIT_BUSY_TIMEOUT = 60000
+# Пауза в секундах между попытками init_db, пока другой процесс переводит файл БД в WAL
+INIT_RETRY_DELAY = 0.05
+
+
+async def table_columns(db, table):
+    """
+    Возвращает список колонок таблицы (пустой, если таблицы нет)
+    """
+    async with db.execute(f"PRAGMA table_info({table})") as cursor:
+        return [row[1] for row in await cursor.fetchall()]
+
+
+async def add_column_if_missing(db, table, column, definition):
+    """
+    Добавляет колонку в существующую таблицу, если её ещё нет
+    """
+    if column not in await table_columns(db, table):
+        await db.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+
+
+async def get_or_create_location(db, latitude, longitude):
+    """
+    Возвращает id локации для координат, округлённых до LOCATION_PRECISION знаков,
+    создавая её при необходимости. Города с одинаковыми координатами делят одну локацию
+    """
+    latitude = round(latitude, LOCATION_PRECISION)
+    longitude = round(longitude, LOCATION_PRECISION)
+    await db.execute("INSERT OR IGNORE INTO locations (latitude, longitude) VALUES (?, ?)", (latitude, longitude))
+    async with db.execute("SELECT id FROM locations WHERE latitude = ? AND longitude = ?", (latitude, longitude)) as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def get_or_create_locations(db, coordinates):
+    """
+    Пакетный вариант get_or_create_location: создаёт недостающие локации одним executemany
+    и одним запросом возвращает их id в порядке coordinates
+    """
+    rounded = [(round(latitude, LOCATION_PRECISION), round(longitude, LOCATION_PRECISION)) for latitude, longitude in coordinates]
+    unique = list(dict.fromkeys(rounded))
+    await db.executemany("INSERT OR IGNORE INTO locations (latitude, longitude) VALUES (?, ?)", unique)
+
+    await db.execute("CREATE TEMP TABLE IF NOT EXISTS wanted_locations (latitude REAL NOT NULL, longitude REAL NOT NULL)")
+    await db.execute("DELETE FROM wanted_locations")
+    await db.executemany("INSERT INTO wanted_locations (latitude, longitude) VALUES (?, ?)", unique)
+    async with db.execute('''SELECT l.latitude, l.longitude, l.id
+                             FROM wanted_locations w
+                             JOIN locations l ON l.latitude = w.latitude AND l.longitude = w.longitude''') as cursor:
+        ids = {(latitude, longitude): location_id for latitude, longitude, location_id in await cursor.fetchall()}
+    await db.execute("DELETE FROM wanted_locations")
+    return [ids[point] for point in rounded]
+
+
+async def _migrate_to_locations(db):
+    """
+    Переводит БД старого формата (weather_data по city_id) на общие локации
+    """
+    await add_column_if_missing(db, 'cities', 'location_id', 'INTEGER REFERENCES locations(id)')
+
+    async with db.execute("SELECT id, latitude, longitude FROM cities WHERE location_id IS NULL") as cursor:
+        cities = await cursor.fetchall()
+    for city_id, latitude, longitude in cities:
+        location_id = await get_or_create_location(db, latitude, longitude)
+        await db.execute("UPDATE cities SET location_id = ? WHERE id = ?", (location_id, city_id))
+
+    if 'city_id' in await table_columns(db, 'weather_data'):
+        await db.execute("ALTER TABLE weather_data RENAME TO weather_data_old")
+        await db.execute(WEATHER_DATA_SCHEMA)
+        await db.execute('''INSERT INTO weather_data (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+                            SELECT c.location_id, w.timestamp, w.temperature, w.surface_pressure, w.wind_speed, w.precipitation
+                            FROM weather_data_old w JOIN cities c ON c.id = w.city_id
+                            GROUP BY c.location_id, w.timestamp''')
+        await db.execute("DROP TABLE weather_data_old")
+        print("Таблица 'weather_data' переведена на общие локации.")
+
+
+async def _create_indexes(db):
+    """
+    Создаёт индексы горячих запросов. Перед созданием уникального индекса
+    weather_data в старых БД удаляются дубли (location_id, timestamp)
+    """
+    async with db.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_weather_data_location_timestamp'") as cursor:
+        has_unique_index = await cursor.fetchone()
+
+    if not has_unique_index:
+        await db.execute('''DELETE FROM weather_data
+                            WHERE id NOT IN (SELECT MAX(id) FROM weather_data GROUP BY location_id, timestamp)''')
+
+    await db.execute("CREATE UNIQUE INDEX IF NOT EXISTS idx_weather_data_location_timestamp ON weather_data(location_id, timestamp)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_cities_user_city ON cities(user_id, city_name)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users(name)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_locations_next_due ON locations(next_due_at)")
+    await db.execute("CREATE INDEX IF NOT EXISTS idx_locations_data_generation ON locations(data_generation)")
+
+
 async def init_db(DB_ROUTE):
     """
-    Инициализирует БД
+    Инициализирует БД. Вызывается в lifespan каждого процесса, поэтому повторный вызов
+    ничего не меняет, а одновременные вызовы из нескольких процессов выполняются по очереди:
+    создание таблиц и миграции идут в одной транзакции BEGIN IMMEDIATE.
+
+    Пока другой процесс выполняет VACUUM или переводит файл в WAL, SQLite отвечает
+    "database is locked" сразу, не дожидаясь busy_timeout, поэтому такие попытки
+    повторяются, пока не пройдёт INIT_BUSY_TIMEOUT
     """
-    async with aiosqlite.connect(DB_ROUTE) as db:
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + INIT_BUSY_TIMEOUT / 1000
+    while True:
         try:
-            await db.execute('''CREATE TABLE IF NOT EXISTS users (
-                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    name TEXT NOT NULL
-                                 )''')
-            
-            await db.execute('''CREATE TABLE IF NOT EXISTS cities (
-                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    city_name TEXT NOT NULL,
-                                    latitude REAL NOT NULL,
-                                    longitude REAL NOT NULL,
-                                    user_id INTEGER,
-                                    FOREIGN KEY(user_id) REFERENCES users(id)
-                                 )''')
-
-            await db.execute('''CREATE TABLE IF NOT EXISTS weather_data (
-                                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                                    city_id INTEGER NOT NULL,
-                                    timestamp DATETIME NOT NULL,
-                                    temperature REAL,
-                                    surface_pressure REAL,
-                                    wind_speed REAL,
-                                    precipitation REAL,
-                                    FOREIGN KEY(city_id) REFERENCES cities(id)
-                                 )''')
-            print("Таблица 'weather_data' успешно создана или уже существует.")
-
-            await db.commit()
-
+            return await _init_db(DB_ROUTE)
+        except aiosqlite.OperationalError as e:
+            if "locked" not in str(e) or loop.time() >= deadline:
+                print(f"Ошибка при инициализации базы данных: {e}")
+                raise
         except Exception as e:
             print(f"Ошибка при инициализации базы данных: {e}")
             raise
+        await asyncio.sleep(INIT_RETRY_DELAY)
+
+
+async def _init_db(DB_ROUTE):
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        await db.execute(f"PRAGMA busy_timeout={INIT_BUSY_TIMEOUT}")
+        async with db.execute("PRAGMA auto_vacuum") as cursor:
+            auto_vacuum = (await cursor.fetchone())[0]
+        if auto_vacuum != 2:
+            await db.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            await db.execute("VACUUM")
+        # Режим WAL сохраняется в файле БД. Файл переводится в него здесь, где "database is locked"
+        # повторяется, поэтому при открытии пула переключать уже нечего
+        await db.execute("PRAGMA journal_mode=WAL")
+
+        await db.execute("BEGIN IMMEDIATE")
+
+        await db.execute('''CREATE TABLE IF NOT EXISTS users (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                name TEXT NOT NULL
+                             )''')
+
+        await db.execute('''CREATE TABLE IF NOT EXISTS locations (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                latitude REAL NOT NULL,
+                                longitude REAL NOT NULL,
+                                forecast_hash TEXT,
+                                next_due_at REAL,
+                                data_generation INTEGER NOT NULL DEFAULT 0,
+                                UNIQUE(latitude, longitude)
+                             )''')
+        await add_column_if_missing(db, 'locations', 'forecast_hash', 'TEXT')
+        await add_column_if_missing(db, 'locations', 'next_due_at', 'REAL')
+        await add_column_if_missing(db, 'locations', 'data_generation', 'INTEGER NOT NULL DEFAULT 0')
+        
+        await db.execute('''CREATE TABLE IF NOT EXISTS cities (
+                                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                                city_name TEXT NOT NULL,
+                                latitude REAL NOT NULL,
+                                longitude REAL NOT NULL,
+                                user_id INTEGER,
+                                location_id INTEGER,
+                                FOREIGN KEY(user_id) REFERENCES users(id),
+                                FOREIGN KEY(location_id) REFERENCES locations(id)
+                             )''')
+
+        await _migrate_to_locations(db)
+
+        await db.execute(WEATHER_DATA_SCHEMA)
+        await db.execute(WEATHER_HOURLY_SCHEMA)
+        await db.execute(WEATHER_COLUMNS_SCHEMA)
+
+        await db.execute('''CREATE TABLE IF NOT EXISTS app_state (
+                                key TEXT PRIMARY KEY,
+                                value INTEGER NOT NULL
+                             )''')
+        await db.execute("INSERT OR IGNORE INTO app_state (key, value) VALUES ('generation', 0), ('listings', 0)")
+        await db.execute('''CREATE TABLE IF NOT EXISTS leases (
+                                name TEXT PRIMARY KEY,
+                                holder TEXT NOT NULL,
+                                expires_at REAL NOT NULL
+                             )''')
+        print("Таблица 'weather_data' успешно создана или уже существует.")
+
+        await _create_indexes(db)
+
+        await db.commit()
+
+
+class Database:
+    """
+    Пул соединений aiosqlite: одно соединение на запись и readers соединений на чтение.
+
+    Соединения открываются в lifespan с WAL-журналом, поэтому чтение не ждёт
+    обновления погоды. Запись сериализуется блокировкой. Пока пул не открыт
+    (тесты, запуск вне lifespan), на каждый вызов открывается отдельное соединение
+    """
+
+    def __init__(self, db_route, readers=DB_POOL_READERS):
+        self.db_route = db_route
+        self.readers_count = readers
+        self._writer = None
+        self._readers = None
+        self._write_lock = None
+
+    @property
+    def is_open(self):
+        return self._writer is not None
+
+    async def _connect(self):
+        db = await aiosqlite.connect(self.db_route)
+        # busy_timeout ставится первым, чтобы и PRAGMA journal_mode ждала занятую БД
+        await db.execute(f"PRAGMA busy_timeout={DB_BUSY_TIMEOUT}")
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("PRAGMA synchronous=NORMAL")
+        await db.execute(f"PRAGMA mmap_size={DB_MMAP_SIZE}")
+        await db.execute(f"PRAGMA cache_size={-DB_CACHE_SIZE}")
+        return db
+
+    async def open(self):
+        """
+        Открывает соединение на запись и соединения на чтение
+        """
+        if self.is_open:
+            return
+        self._write_lock = asyncio.Lock()
+        self._readers = asyncio.Queue()
+        for _ in range(self.readers_count):
+            self._readers.put_nowait(await self._connect())
+        self._writer = await self._connect()
+
+    async def close(self):
+        """
+        Закрывает все соединения пула
+        """
+        if not self.is_open:
+            return
+        writer, self._writer = self._writer, None
+        await writer.close()
+        while not self._readers.empty():
+            await self._readers.get_nowait().close()
+
+    @asynccontextmanager
+    async def reader(self):
+        """
+        Выдаёт соединение на чтение из пула
+        """
+        if not self.is_open:
+            async with aiosqlite.connect(self.db_route) as db:
+                yield db
+            return
 
+        db = await self._readers.get()
+        try:
+            yield db
+        finally:
+            self._readers.put_nowait(db)
+
+    @asynccontextmanager
+    async def writer(self):
+        """
+        Выдаёт единственное соединение на запись. Незафиксированные изменения
+        откатываются, если внутри блока возникла ошибка
+        """
+        if not self.is_open:
+            async with aiosqlite.connect(self.db_route) as db:
+                yield db
+            return
+
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+database = Database(DB_ROUTE)
+
+
+def get_database():
+    """
+    Зависимость FastAPI, отдающая пул соединений
+    """
+    return database
@@ -0,0 +1,51 @@
+from typing import Optional
+from contextlib import asynccontextmanager
+
+import aiohttp
+
+from settings import (HTTP_POOL_LIMIT, HTTP_POOL_LIMIT_PER_HOST, HTTP_DNS_CACHE_TTL,
+                      HTTP_KEEPALIVE_TIMEOUT, HTTP_TIMEOUT)
+
+
+_session: Optional[aiohttp.ClientSession] = None
+
+
+async def start():
+    """
+    Создаёт общую для всего приложения сессию aiohttp с пулом keep-alive соединений.
+    Вызывается из lifespan
+    """
+    global _session
+    if _session is not None and not _session.closed:
+        return _session
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    _session = aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT))
+    return _session
+
+
+async def close():
+    """
+    Закрывает общую сессию и все соединения пула
+    """
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
+
+
+@asynccontextmanager
+async def session():
+    """
+    Отдаёт общую сессию, а если она не запущена (тесты, запуск вне lifespan) -
+    временную сессию на один запрос
+    """
+    if _session is not None and not _session.closed:
+        yield _session
+    else:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT)) as temp_session:
+            yield temp_session
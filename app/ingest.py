@@ -0,0 +1,77 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from app.db import Database
+from settings import DB_ROUTE
+
+
+class IngestProcess:
+    """
+    Отдельный процесс для разбора и записи прогнозов (INGEST_MODE=process).
+
+    Ответы api запрашиваются в основном процессе, а разбор JSON, сборка строк, сравнение хешей
+    и запись в SQLite выполняются в дочернем процессе через его собственное соединение на запись,
+    поэтому обновление погоды не занимает цикл событий, который обслуживает запросы.
+    Процесс один: в SQLite всё равно пишет только одно соединение одновременно.
+
+    Процесс запускается через spawn, а не fork, чтобы не унаследовать потоки
+    соединений aiosqlite и сессию aiohttp основного процесса
+    """
+
+    def __init__(self, db_route):
+        self.db_route = db_route
+        self._executor = None
+
+    @property
+    def is_running(self):
+        return self._executor is not None
+
+    async def start(self):
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=_init_process,
+                initargs=(self.db_route,),
+            )
+
+    async def close(self):
+        if self._executor is not None:
+            executor, self._executor = self._executor, None
+            loop = asyncio.get_running_loop()
+            await loop.run_in_executor(executor, _close_process)
+            await loop.run_in_executor(None, executor.shutdown)
+
+    async def run(self, func, *args):
+        """
+        Выполняет в процессе корутину func(database, *args), где database - пул процесса
+        с единственным соединением на запись. func и аргументы передаются через pickle,
+        поэтому func должна быть функцией уровня модуля
+        """
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, _run, func, args)
+
+
+# Состояние дочернего процесса: свой цикл событий и своё соединение с БД
+_loop = None
+_database = None
+
+
+def _init_process(db_route):
+    global _loop, _database
+    _loop = asyncio.new_event_loop()
+    _database = Database(db_route, readers=0)
+    _loop.run_until_complete(_database.open())
+
+
+def _run(func, args):
+    return _loop.run_until_complete(func(_database, *args))
+
+
+def _close_process():
+    if _database is not None:
+        _loop.run_until_complete(_database.close())
+
+
+ingest = IngestProcess(DB_ROUTE)
@@ -0,0 +1,85 @@
+import os
+import time
+import uuid
+import socket
+from functools import wraps
+
+from app.db import database
+from settings import LEADER_LEASE_TTL
+
+
+class LeaderLease:
+    """
+    Выбор ведущего процесса через строку аренды в таблице leases.
+
+    При запуске под uvicorn --workers N планировщик работает в каждом процессе, но обновлять
+    погоду и сжимать историю должен только один. Процесс, который успел занять аренду, продлевает
+    её каждые ttl / 3 секунд. Если ведущий завис или завершился, аренда истекает через ttl секунд
+    и её занимает следующий процесс. Остальные процессы узнают о новых данных по поколению
+    в БД (app/snapshot.py, sync_generation)
+    """
+
+    def __init__(self, name, ttl):
+        self.name = name
+        self.ttl = ttl
+        self.holder = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.expires_at = 0.0
+
+    @property
+    def is_leader(self):
+        """
+        Держит ли процесс аренду. Проверяется по локальным часам с запасом, чтобы не действовать
+        по аренде, которую другой процесс уже может занять
+        """
+        return time.time() < self.expires_at - self.ttl / 3
+
+    async def acquire(self):
+        """
+        Занимает свободную или истёкшую аренду либо продлевает свою. Возвращает, ведущий ли процесс
+        """
+        now = time.time()
+        try:
+            async with database.writer() as db:
+                await db.execute('''
+                    INSERT INTO leases (name, holder, expires_at) VALUES (?, ?, ?)
+                    ON CONFLICT(name) DO UPDATE SET holder = excluded.holder, expires_at = excluded.expires_at
+                    WHERE leases.holder = excluded.holder OR leases.expires_at < ?
+                ''', (self.name, self.holder, now + self.ttl, now))
+                await db.commit()
+                async with db.execute('SELECT holder FROM leases WHERE name = ?', (self.name,)) as cursor:
+                    holder = (await cursor.fetchone())[0]
+        except Exception as e:
+            print(f"Ошибка при продлении аренды ведущего: {e}")
+            return self.is_leader
+
+        was_leader = self.is_leader
+        self.expires_at = now + self.ttl if holder == self.holder else 0.0
+        if self.is_leader != was_leader:
+            print(f"Процесс {self.holder} {'стал ведущим' if self.is_leader else 'больше не ведущий'}.")
+        return self.is_leader
+
+    async def release(self):
+        """
+        Освобождает аренду при остановке, чтобы другой процесс занял её сразу
+        """
+        if self.expires_at == 0.0:
+            return
+        self.expires_at = 0.0
+        async with database.writer() as db:
+            await db.execute('DELETE FROM leases WHERE name = ? AND holder = ?', (self.name, self.holder))
+            await db.commit()
+
+
+def leader_only(job):
+    """
+    Оборачивает задачу планировщика так, что она выполняется только в ведущем процессе
+    """
+    @wraps(job)
+    async def wrapper(*args, **kwargs):
+        if not leader.is_leader:
+            return None
+        return await job(*args, **kwargs)
+    return wrapper
+
+
+leader = LeaderLease('refresh', LEADER_LEASE_TTL)
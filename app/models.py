@@ -1,4 +1,7 @@
-from pydantic import BaseModel,Field
+from typing import Optional
+
+from pydantic import BaseModel, Field, TypeAdapter
+from typing_extensions import NotRequired, TypedDict
 
 class CityRequest(BaseModel):
     """
@@ -16,4 +19,50 @@ class CityRequest(BaseModel):
         ge=-180.0,
         le=180.0,
         description="Долгота (от -180 до 180)"
-    )
\ No newline at end of file
+    )
+
+
+# Проверяет весь список городов для /import за один проход прямо из байтов запроса
+city_requests_adapter = TypeAdapter(list[CityRequest])
+
+
+class Minutely15(TypedDict):
+    """
+    Блок minutely_15 ответа api.open-meteo.com, массивы значений по слотам
+    """
+    time: list[str]
+    temperature_2m: list[Optional[float]]
+    surface_pressure: list[Optional[float]]
+    wind_speed_10m: list[Optional[float]]
+    precipitation: list[Optional[float]]
+
+
+class Forecast(TypedDict):
+    """
+    Прогноз одной локации из ответа api.open-meteo.com
+    """
+    minutely_15: Minutely15
+
+
+class Current(TypedDict):
+    """
+    Блок current ответа api.open-meteo.com
+    """
+    temperature_2m: Optional[float]
+    surface_pressure: Optional[float]
+    wind_speed_10m: Optional[float]
+
+
+class CurrentResponse(TypedDict):
+    """
+    Ответ api.open-meteo.com на запрос текущей погоды
+    """
+    current: NotRequired[Current]
+
+
+# Разбирают ответ api прямо из байтов (validate_json), одновременно проверяя структуру.
+# Результат - обычные dict и list, лишние поля ответа отбрасываются.
+# Для нескольких локаций api отдаёт список прогнозов, для одной - один объект
+forecast_list_adapter = TypeAdapter(list[Forecast])
+forecast_adapter = TypeAdapter(Forecast)
+current_adapter = TypeAdapter(CurrentResponse)
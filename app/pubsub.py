@@ -0,0 +1,91 @@
+import asyncio
+
+from settings import SSE_BUFFER_SIZE
+
+
+class Subscription:
+    """
+    Подписка на обновления прогнозов набора локаций.
+
+    Обновления (поколение, изменившиеся location_id) копятся в очереди из buffer_size элементов.
+    Если клиент не успевает их забирать и очередь переполнена, накопленные обновления
+    заменяются одним обновлением всех локаций подписки (location_ids=None): клиент получит
+    актуальные значения, а память на медленного клиента не растёт
+    """
+
+    def __init__(self, location_ids, buffer_size):
+        self.location_ids = frozenset(location_ids)
+        self.dropped = 0
+        self._queue = asyncio.Queue(maxsize=buffer_size)
+
+    def push(self, generation, location_ids):
+        try:
+            self._queue.put_nowait((generation, location_ids))
+        except asyncio.QueueFull:
+            while not self._queue.empty():
+                self._queue.get_nowait()
+                self.dropped += 1
+            self._queue.put_nowait((generation, None))
+
+    async def get(self):
+        """
+        Ждёт следующее обновление: (поколение, frozenset изменившихся location_id или None - все локации подписки)
+        """
+        return await self._queue.get()
+
+
+class Broker:
+    """
+    Рассылка обновлений прогнозов подписчикам внутри процесса.
+    Подписки индексируются по location_id, поэтому публикация затрагивает только тех,
+    кто следит за изменившимися локациями
+    """
+
+    def __init__(self, buffer_size):
+        self.buffer_size = buffer_size
+        self._subscriptions = set()
+        self._by_location = {}
+
+    def subscribe(self, location_ids):
+        subscription = Subscription(location_ids, self.buffer_size)
+        self._subscriptions.add(subscription)
+        for location_id in subscription.location_ids:
+            self._by_location.setdefault(location_id, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        self._subscriptions.discard(subscription)
+        for location_id in subscription.location_ids:
+            subscribers = self._by_location.get(location_id)
+            if subscribers is not None:
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del self._by_location[location_id]
+
+    def publish(self, generation, location_ids=None):
+        """
+        Сообщает подписчикам о новых данных локаций location_ids (None - данные всех локаций перечитаны)
+        """
+        if not self._subscriptions:
+            return
+        if location_ids is None:
+            for subscription in self._subscriptions:
+                subscription.push(generation, None)
+            return
+
+        changed = {}
+        for location_id in location_ids:
+            for subscription in self._by_location.get(location_id, ()):
+                changed.setdefault(subscription, set()).add(location_id)
+        for subscription, subscription_changed in changed.items():
+            subscription.push(generation, frozenset(subscription_changed))
+
+    def stats(self):
+        return {
+            "subscribers": len(self._subscriptions),
+            "locations": len(self._by_location),
+            "dropped": sum(subscription.dropped for subscription in self._subscriptions),
+        }
+
+
+forecast_updates = Broker(SSE_BUFFER_SIZE)
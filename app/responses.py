@@ -0,0 +1,34 @@
+from fastapi import responses
+from pydantic_core import to_json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def dumps(content):
+    """
+    Сериализует content в JSON-байты через orjson, если он установлен, иначе через
+    pydantic_core.to_json (идёт вместе с FastAPI). NaN и бесконечности в обоих случаях становятся null
+    """
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+    return to_json(content, inf_nan_mode='null')
+
+
+class JSONResponse(responses.JSONResponse):
+    """
+    JSONResponse с быстрой сериализацией вместо стандартного json.dumps.
+    Используется всеми маршрутами и как default_response_class приложения
+    """
+
+    def render(self, content):
+        return dumps(content)
+
+
+class RawJSONResponse(responses.Response):
+    """
+    Ответ из уже сериализованных JSON-байтов, например заранее посчитанного списка городов
+    """
+    media_type = "application/json"
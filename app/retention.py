@@ -0,0 +1,40 @@
+from datetime import date, timedelta
+
+from app.db import database
+from app.snapshot import bump_generation, publish_generation
+from app.storage import storage
+from settings import RAW_RETENTION_DAYS, HOURLY_RETENTION_DAYS
+
+
+async def compact_weather_data(today=None):
+    """
+    Сжимает историю погоды, чтобы размер БД не рос бесконечно:
+    дни старше RAW_RETENTION_DAYS сворачиваются хранилищем storage в часовые агрегаты
+    weather_hourly (среднее для температуры, давления и ветра, сумма для осадков),
+    после чего 15-минутные данные удаляются. Часовые агрегаты старше HOURLY_RETENTION_DAYS
+    удаляются, освободившиеся страницы возвращаются через incremental_vacuum
+    """
+    today = today or date.today()
+    raw_cutoff = f"{today - timedelta(days=RAW_RETENTION_DAYS)} 00:00:00"
+    hourly_cutoff = f"{today - timedelta(days=HOURLY_RETENTION_DAYS)} 00:00:00"
+
+    try:
+        async with database.writer() as db:
+            hourly_rows, raw_deleted = await storage.compact(db, raw_cutoff)
+            cursor = await db.execute('''DELETE FROM weather_hourly
+                                         WHERE location_id IN (SELECT id FROM locations) AND timestamp < ?''', (hourly_cutoff,))
+            hourly_deleted = cursor.rowcount
+            generation = await bump_generation(db)
+            await db.commit()
+
+            # execute выполняет только один шаг прагмы и освобождает одну страницу,
+            # executescript доводит её до конца
+            await db.executescript("PRAGMA incremental_vacuum;")
+        await publish_generation(generation)
+
+        stats = {"hourly_rows": hourly_rows, "raw_deleted": raw_deleted, "hourly_deleted": hourly_deleted}
+        print(f"Сжатие истории погоды завершено: {stats}")
+        return stats
+
+    except Exception as e:
+        print(f"Ошибка при сжатии истории погоды: {e}")
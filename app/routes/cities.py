@@ -1,25 +1,47 @@
-from datetime import datetime
+import asyncio
+from datetime import datetime, timedelta
 from typing import Optional, List
 
 import aiosqlite
-from fastapi import APIRouter, Query, Path
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Query, Path, Depends, Request
+from fastapi.responses import StreamingResponse
+from pydantic import ValidationError
 
-from app.models import CityRequest
-from app.service import upd_data_to_db
-from settings import DB_ROUTE
+from app.backfill import backfill
+from app.db import Database, get_database, get_or_create_location, get_or_create_locations
+from app.models import CityRequest, city_requests_adapter
+from app.pubsub import forecast_updates
+from app.responses import JSONResponse, RawJSONResponse, dumps
+from app.storage import storage, WEATHER_COLUMNS, SLOT_MINUTES, SLOTS_PER_DAY
+from app import snapshot as forecast_snapshot
+from settings import SSE_KEEPALIVE
 
 
 router = APIRouter()
 
+# Готовые JSON-байты ответов /cities/cities по user_id (None - общий список) вместе с поколением
+# списков городов, при котором они собраны. Списки меняются редко, поэтому сериализуются один раз.
+# Добавление города в любом процессе увеличивает поколение списков, и старые ответы перестают использоваться
+city_listings = {}
+
+
+def invalidate_city_listings():
+    """
+    Сбрасывает готовые ответы /cities/cities
+    """
+    city_listings.clear()
+
 @router.post('/add_city')
 async def add_city(city_request: CityRequest,
-                   user_id: Optional[str] = Query(None, description="ID пользователя (необязательно)")):
+                   user_id: Optional[str] = Query(None, description="ID пользователя (необязательно)"),
+                   database: Database = Depends(get_database)):
     """
     Добавляет город в список отслеживания для пользователя (если указан user_id) или общий список.
+    Прогноз для нового города загружается в фоне (app/backfill.py), его состояние
+    возвращается в weather_status и доступно через GET /cities/{city_name}/status
     """
     try:
-        async with aiosqlite.connect(DB_ROUTE) as db:
+        async with database.writer() as db:
             if user_id != None:
                 async with db.execute('SELECT * FROM users WHERE id = ?', (user_id,)) as cursor:
                     user_exists = await cursor.fetchone()
@@ -38,56 +60,134 @@ async def add_city(city_request: CityRequest,
             if existing_city:
                 return JSONResponse(status_code=200,content={"message": f"Город {city_request.city_name} уже отслеживается."})
             
+            location_id = await get_or_create_location(db, city_request.latitude, city_request.longitude)
             await db.execute(
-                "INSERT INTO cities (user_id, city_name, latitude, longitude) VALUES (?, ?, ?, ?)", 
-                (user_id, city_request.city_name, city_request.latitude, city_request.longitude)
+                "INSERT INTO cities (user_id, city_name, latitude, longitude, location_id) VALUES (?, ?, ?, ?, ?)", 
+                (user_id, city_request.city_name, city_request.latitude, city_request.longitude, location_id)
             )
-            await db.commit()
-
             async with db.execute("SELECT last_insert_rowid()") as cursor:
                 city_id_row = await cursor.fetchone()
                 city_id = city_id_row[0] if city_id_row else None
 
-            try:
-                await upd_data_to_db(city_request.city_name)
-            except Exception as e:
-                return JSONResponse(
-                    status_code=500,
-                    content={
-                        "message": f"Город {city_request.city_name} добавлен, но обновление данных погоды не удалось.",
-                        "error": str(e),
-                        "city": {
-                            "city_id": city_id,
-                            "city_name": city_request.city_name,
-                            "latitude": city_request.latitude,
-                            "longitude": city_request.longitude,
-                            "user_id": user_id
-                        }
-                    }
-                )
-            return JSONResponse(status_code=201,
-                                content={
-                                    "message": f"Город {city_request.city_name} успешно добавлен.",
-                                    "city": {
-                                        "city_id": city_id,
-                                        "city_name": city_request.city_name,
-                                        "latitude": city_request.latitude,
-                                        "longitude": city_request.longitude,
-                                        "user_id": user_id
-                                            }
-                                        })
+            generation = await forecast_snapshot.bump_generation(db)
+            listings_generation = await forecast_snapshot.bump_listings_generation(db)
+            await db.commit()
+        invalidate_city_listings()
+        forecast_snapshot.publish_listings_generation(listings_generation)
+        await forecast_snapshot.publish_generation(generation)
+
+        await backfill.enqueue([location_id])
+        return JSONResponse(status_code=201,
+                            content={
+                                "message": f"Город {city_request.city_name} успешно добавлен.",
+                                "city": {
+                                    "city_id": city_id,
+                                    "city_name": city_request.city_name,
+                                    "latitude": city_request.latitude,
+                                    "longitude": city_request.longitude,
+                                    "user_id": user_id
+                                        },
+                                "weather_status": backfill.status(location_id)
+                                    })
     except aiosqlite.Error as e:
-        return JSONResponse(status_code=500,content={"message": f"Ошибка базы данных: {str(e)}, база {DB_ROUTE}"})
+        return JSONResponse(status_code=500,content={"message": f"Ошибка базы данных: {str(e)}, база {database.db_route}"})
     except Exception as e:
         return JSONResponse(status_code=500,content={"message": f"Неизвестная ошибка: {str(e)}"})
     
+def _parse_city_import(body, content_type):
+    """
+    Разбирает и проверяет тело /import: JSON-массив CityRequest или NDJSON (по объекту на строку).
+    NDJSON склеивается в массив, поэтому весь список проверяется одним validate_json,
+    а номер элемента в ошибке совпадает с номером непустой строки
+    """
+    if "ndjson" in content_type or "jsonl" in content_type or not body.lstrip().startswith(b"["):
+        body = b"[" + b",".join(line for line in body.splitlines() if line.strip()) + b"]"
+    return city_requests_adapter.validate_json(body)
+
+
+@router.post('/import')
+async def import_cities(request: Request,
+                        user_id: Optional[str] = Query(None, description="ID пользователя (необязательно)"),
+                        database: Database = Depends(get_database)):
+    """
+    Массово добавляет города пользователю (если указан user_id) или в общий список.
+    Тело - JSON-массив объектов CityRequest или NDJSON. Весь список проверяется за один проход,
+    уже отслеживаемые города отсеиваются одним запросом, новые вставляются одним executemany
+    в одной транзакции, а их локации ставятся в фоновую очередь загрузки прогнозов
+    """
+    try:
+        city_requests = _parse_city_import(await request.body(), request.headers.get("content-type", ""))
+    except ValidationError as e:
+        return JSONResponse(status_code=422, content={"message": "Некорректный список городов",
+                                                      "errors": e.errors(include_url=False, include_context=False)})
+
+    unique_requests = {}
+    for city_request in city_requests:
+        unique_requests.setdefault(city_request.city_name, city_request)
+    unique_requests = list(unique_requests.values())
+
+    try:
+        async with database.writer() as db:
+            if user_id != None:
+                async with db.execute('SELECT * FROM users WHERE id = ?', (user_id,)) as cursor:
+                    user_exists = await cursor.fetchone()
+
+                if not user_exists:
+                    return JSONResponse(status_code=404,content={"message": f"Пользователь с ID {user_id} не существует."})
+
+            async with db.execute('''SELECT city_name FROM cities
+                                     WHERE user_id IS ? AND city_name IN (SELECT value FROM json_each(?))''',
+                                  (user_id, dumps([city_request.city_name for city_request in unique_requests]).decode())) as cursor:
+                existing = {row[0] for row in await cursor.fetchall()}
+
+            new_requests = [city_request for city_request in unique_requests if city_request.city_name not in existing]
+            location_ids = await get_or_create_locations(
+                db, [(city_request.latitude, city_request.longitude) for city_request in new_requests]
+            )
+            await db.executemany(
+                "INSERT INTO cities (user_id, city_name, latitude, longitude, location_id) VALUES (?, ?, ?, ?, ?)",
+                [(user_id, city_request.city_name, city_request.latitude, city_request.longitude, location_id)
+                 for city_request, location_id in zip(new_requests, location_ids)]
+            )
+            if new_requests:
+                generation = await forecast_snapshot.bump_generation(db)
+                listings_generation = await forecast_snapshot.bump_listings_generation(db)
+            await db.commit()
+
+        if new_requests:
+            invalidate_city_listings()
+            forecast_snapshot.publish_listings_generation(listings_generation)
+            await forecast_snapshot.publish_generation(generation)
+            await backfill.enqueue(location_ids)
+
+        return JSONResponse(status_code=201 if new_requests else 200,
+                            content={
+                                "message": f"Добавлено городов: {len(new_requests)}.",
+                                "received": len(city_requests),
+                                "imported": len(new_requests),
+                                "skipped": len(city_requests) - len(new_requests),
+                                "locations": len(set(location_ids)),
+                            })
+    except aiosqlite.Error as e:
+        return JSONResponse(status_code=500,content={"message": f"Ошибка базы данных: {str(e)}"})
+    except Exception as e:
+        return JSONResponse(status_code=500,content={"message": f"Неизвестная ошибка: {str(e)}"})
+
+
 @router.get('/cities')
-async def cities(user_id: Optional[str] = None):
+async def cities(user_id: Optional[str] = None, database: Database = Depends(get_database)):
     """
     Возвращает список городов для пользователя (если указан user_id) или общий список.
+    Готовый ответ хранится в city_listings, пока не изменится поколение списков городов
+    (запись прогнозов его не меняет)
     """
+    generation = forecast_snapshot.listings_generation()
+    cached = city_listings.get(user_id)
+    if cached is not None and cached[0] == generation:
+        return RawJSONResponse(content=cached[1])
+
     try:
-        async with aiosqlite.connect(DB_ROUTE) as db:
+        async with database.reader() as db:
             if user_id != None:
                 async with db.execute('SELECT * FROM users WHERE id = ?', (user_id,)) as cursor:
                     user_exists = await cursor.fetchone()
@@ -112,13 +212,17 @@ async def cities(user_id: Optional[str] = None):
                     cities = await cursor.fetchall()
             
             if not cities:
-                return JSONResponse(status_code=200,content={"message": "Нет доступных городов для отображения.", "cities": []})
-            
-            city_list = [
-                {"city_name": city[0], "latitude": city[1], "longitude": city[2]} 
-                for city in cities
-            ]
-            return JSONResponse(status_code=200,content={"message": "Список городов успешно получен.", "cities": city_list})
+                content = {"message": "Нет доступных городов для отображения.", "cities": []}
+            else:
+                city_list = [
+                    {"city_name": city[0], "latitude": city[1], "longitude": city[2]} 
+                    for city in cities
+                ]
+                content = {"message": "Список городов успешно получен.", "cities": city_list}
+
+        listing = dumps(content)
+        city_listings[user_id] = (generation, listing)
+        return RawJSONResponse(content=listing)
     except aiosqlite.Error as e:
         return JSONResponse(status_code=500,content={"message": f"Ошибка базы данных: {str(e)}"})
     except Exception as e:
@@ -127,68 +231,539 @@ async def cities(user_id: Optional[str] = None):
 
 
 
+async def _batch_locations(db, user_id, city_names):
+    """
+    Одним запросом находит location_id городов пользователя (user_id!=None) или общих городов.
+    city_names=None - все города. Возвращает ({city_name: location_id}, None)
+    или (None, JSONResponse с ошибкой 404), если пользователя нет
+    """
+    names_filter = ''
+    if city_names is not None:
+        names_filter = f"AND c.city_name IN ({', '.join('?' * len(city_names))})"
+
+    if user_id != None:
+        query = f'''
+            SELECT u.id, c.city_name, c.location_id
+            FROM users u
+            LEFT JOIN cities c ON c.user_id = u.id {names_filter}
+            WHERE u.id = ?
+            ORDER BY c.id
+        '''
+        async with db.execute(query, (*(city_names or ()), user_id)) as cursor:
+            rows = await cursor.fetchall()
+        if not rows:
+            return None, JSONResponse(status_code=404, content={"message": f"Пользователь с ID {user_id} не существует."})
+    else:
+        query = f'''
+            SELECT NULL, c.city_name, c.location_id
+            FROM cities c
+            WHERE c.user_id IS NULL {names_filter}
+            ORDER BY c.id
+        '''
+        async with db.execute(query, tuple(city_names or ())) as cursor:
+            rows = await cursor.fetchall()
+
+    locations = {}
+    for _, city_name, location_id in rows:
+        if city_name is not None:
+            locations.setdefault(city_name, location_id)
+    return locations, None
+
+
+def _snapshot_records(snapshot, location_id, start, end, selected_columns):
+    """
+    Записи (timestamp, *значения) слотов снимка с start по end (в пределах дня снимка)
+    или None, если локации в снимке нет
+    """
+    if location_id not in snapshot.series:
+        return None
+    day_start = datetime.combine(snapshot.day, datetime.min.time())
+    first_slot = max(0, -(-int((start - day_start).total_seconds()) // (SLOT_MINUTES * 60)))
+    last_slot = min(SLOTS_PER_DAY - 1, int((end - day_start).total_seconds()) // (SLOT_MINUTES * 60))
+    records = []
+    for slot in range(first_slot, last_slot + 1):
+        values = snapshot.values(location_id, slot, selected_columns)
+        if values is not None:
+            records.append((str(day_start + timedelta(minutes=slot * SLOT_MINUTES)),
+                            *(values[column] for column in selected_columns)))
+    return records
+
+
+async def _batch_values(db, snapshot, location_ids, moment, selected_columns, method):
+    """
+    Значения на момент moment для нескольких локаций: из снимка, а для локаций,
+    которых в снимке нет, - одним запросом к хранилищу. {location_id: значения или None}
+    """
+    values = {}
+    pending = []
+    for location_id in location_ids:
+        value = None
+        if snapshot is not None and snapshot.day == moment.date():
+            value = _snapshot_value(snapshot, location_id, moment, selected_columns, method)
+        if value is None:
+            pending.append(location_id)
+        values[location_id] = value
+
+    if pending:
+        tolerance = timedelta(minutes=SLOT_MINUTES)
+        records = await storage.read_range_many(db, pending, moment - tolerance, moment + tolerance, selected_columns)
+        for location_id in pending:
+            values[location_id] = _records_value(records.get(location_id, []), moment, selected_columns, method)
+    return values
+
+
+async def _batch_records(db, snapshot, location_ids, start, end, selected_columns):
+    """
+    Записи (timestamp, *значения) за диапазон для нескольких локаций: из снимка, если диапазон
+    целиком в дне снимка, иначе одним запросом к хранилищу. Для локаций без 15-минутных данных
+    (история сжата) берутся часовые агрегаты. {location_id: записи}
+    """
+    records = {}
+    pending = []
+    in_snapshot = snapshot is not None and start.date() == end.date() == snapshot.day
+    for location_id in location_ids:
+        location_records = _snapshot_records(snapshot, location_id, start, end, selected_columns) if in_snapshot else None
+        if location_records is None:
+            pending.append(location_id)
+        else:
+            records[location_id] = location_records
+
+    if pending:
+        records.update(await storage.read_range_many(db, pending, start, end, selected_columns))
+        compacted = [location_id for location_id in pending if not records.get(location_id)]
+        if compacted:
+            records.update(await storage.read_hourly_range_many(db, compacted, start, end, selected_columns))
+    return records
+
+
+@router.get('/batch')
+async def cities_batch(
+    user_id: Optional[str] = Query(None, description="ID пользователя (необязательно)"),
+    city_names: Optional[List[str]] = Query(None, alias="cities", description="Названия городов (параметр повторяется). Если не указано или 'all', берутся все города"),
+    time: Optional[str] = Query(None, description="Время в формате 'HH:MM:SS'. Если не указано, возвращаются ряды за диапазон from-to"),
+    day: Optional[str] = Query(None, alias="date", description="Дата в формате 'YYYY-MM-DD' (по умолчанию сегодня)"),
+    time_from: Optional[str] = Query(None, alias="from", description="Начало диапазона: 'HH:MM:SS' на дату date или 'YYYY-MM-DDTHH:MM:SS' (по умолчанию начало дня)"),
+    time_to: Optional[str] = Query(None, alias="to", description="Конец диапазона включительно (по умолчанию конец дня)"),
+    step: int = Query(SLOT_MINUTES, description="Шаг рядов в минутах, кратный 15"),
+    method: str = Query("linear", description="Как получить значение между слотами: 'linear' (интерполяция) или 'nearest' (ближайший слот)"),
+    weather_params: Optional[List[str]] = Query(
+        ["temperature", "surface_pressure", "wind_speed", "precipitation"],
+        description="Параметры погоды, которые нужно вернуть"
+    ),
+    database: Database = Depends(get_database)
+):
+    """
+    Погода сразу для нескольких городов пользователя (или общих городов) вместо отдельного запроса на каждый город.
+    Города находятся одним запросом, значения берутся из снимка сегодняшних прогнозов,
+    а чего в снимке нет - одним запросом к хранилищу для всех локаций.
+
+    Ответ собирается по колонкам: city_name - список городов, для каждого параметра погоды -
+    список значений в том же порядке (на время time) или список рядов по общей оси timestamp
+    (за диапазон). Нет данных - null. missing - запрошенные города, которые не отслеживаются
+    """
+    selected_columns = [param for param in weather_params if param in WEATHER_COLUMNS]
+    if not selected_columns:
+        return JSONResponse(status_code=400, content={"message": "Некорректные параметры погоды"})
+    if method not in ("linear", "nearest"):
+        return JSONResponse(status_code=400, content={"message": "Параметр method должен быть 'linear' или 'nearest'"})
+    if step <= 0 or step % SLOT_MINUTES:
+        return JSONResponse(status_code=400, content={"message": f"Шаг должен быть кратен {SLOT_MINUTES} минутам"})
+
+    try:
+        current_date = datetime.strptime(day, "%Y-%m-%d").date() if day else datetime.now().date()
+        if time is not None:
+            moment = _parse_time(time, current_date)
+        else:
+            start = _range_bound(time_from, current_date, datetime.combine(current_date, datetime.min.time()))
+            end = _range_bound(time_to, current_date, datetime.combine(current_date, datetime.max.time().replace(microsecond=0)))
+    except ValueError:
+        return JSONResponse(status_code=400, content={"message": "Некорректный формат даты или времени"})
+    if time is None and start > end:
+        return JSONResponse(status_code=400, content={"message": "Начало диапазона позже его конца"})
+
+    if city_names is not None and "all" in city_names:
+        city_names = None
+    if city_names is not None:
+        city_names = list(dict.fromkeys(city_names))
+
+    try:
+        snapshot = forecast_snapshot.current()
+        async with database.reader() as db:
+            locations, error = await _batch_locations(db, user_id, city_names)
+            if error:
+                return error
+            names = [name for name in (city_names or locations) if name in locations]
+            location_ids = list(dict.fromkeys(locations[name] for name in names))
+
+            result = {"city_name": names}
+            if time is not None:
+                values = await _batch_values(db, snapshot, location_ids, moment, selected_columns, method)
+                result["time"] = str(moment)
+                for column in selected_columns:
+                    result[column] = [None if values[locations[name]] is None else values[locations[name]][column]
+                                      for name in names]
+            else:
+                records = await _batch_records(db, snapshot, location_ids, start, end, selected_columns)
+                timestamps = sorted({record[0] for location_records in records.values() for record in location_records})
+                if step != SLOT_MINUTES and timestamps:
+                    first = datetime.fromisoformat(timestamps[0])
+                    timestamps = [timestamp for timestamp in timestamps
+                                  if (datetime.fromisoformat(timestamp) - first).total_seconds() // 60 % step == 0]
+                positions = {timestamp: position for position, timestamp in enumerate(timestamps)}
+                series = {}
+                for location_id, location_records in records.items():
+                    columns = [[None] * len(timestamps) for _ in selected_columns]
+                    for timestamp, *record_values in location_records:
+                        position = positions.get(timestamp)
+                        if position is not None:
+                            for column_values, value in zip(columns, record_values):
+                                column_values[position] = value
+                    series[location_id] = columns
+                empty = [[None] * len(timestamps) for _ in selected_columns]
+                result["timestamp"] = timestamps
+                for index, column in enumerate(selected_columns):
+                    result[column] = [series.get(locations[name], empty)[index] for name in names]
+
+        result["missing"] = [name for name in city_names or () if name not in locations]
+        return JSONResponse(status_code=200, content=result)
+    except aiosqlite.Error as e:
+        return JSONResponse(status_code=500, content={"message": f"Ошибка базы данных: {str(e)}"})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": f"Неизвестная ошибка: {str(e)}"})
+
+
+def _forecast_event(generation, locations, location_ids, selected_columns):
+    """
+    Событие SSE со значениями на текущее время для городов, чьи локации в location_ids
+    (None - все города подписки). Значения берутся из снимка, нет данных - null
+    """
+    snapshot = forecast_snapshot.current()
+    moment = datetime.now()
+    names = [name for name, location_id in locations.items() if location_ids is None or location_id in location_ids]
+    values = {}
+    for name in names:
+        location_id = locations[name]
+        if location_id not in values:
+            values[location_id] = None
+            if snapshot is not None and snapshot.day == moment.date():
+                values[location_id] = _snapshot_value(snapshot, location_id, moment, selected_columns, "linear")
+
+    content = {"generation": generation, "time": str(moment.replace(microsecond=0)), "city_name": names}
+    for column in selected_columns:
+        content[column] = [None if values[locations[name]] is None else values[locations[name]][column] for name in names]
+    return b"event: forecast\nid: " + str(generation).encode() + b"\ndata: " + dumps(content) + b"\n\n"
+
+
+async def _forecast_events(subscription, locations, selected_columns, keepalive):
+    """
+    Поток SSE подписки: сразу текущие значения всех городов, затем событие на каждое обновление
+    их прогнозов и комментарий раз в keepalive секунд без обновлений, чтобы прокси не закрывали соединение.
+    При отключении клиента подписка снимается
+    """
+    try:
+        yield _forecast_event(forecast_snapshot.generation(), locations, None, selected_columns)
+        while True:
+            try:
+                generation, location_ids = await asyncio.wait_for(subscription.get(), keepalive)
+            except asyncio.TimeoutError:
+                yield b": keepalive\n\n"
+                continue
+            yield _forecast_event(generation, locations, location_ids, selected_columns)
+    finally:
+        forecast_updates.unsubscribe(subscription)
+
+
+@router.get('/stream')
+async def cities_stream(
+    user_id: Optional[str] = Query(None, description="ID пользователя (необязательно)"),
+    city_names: Optional[List[str]] = Query(None, alias="cities", description="Названия городов (параметр повторяется). Если не указано или 'all', берутся все города"),
+    weather_params: Optional[List[str]] = Query(
+        ["temperature", "surface_pressure", "wind_speed", "precipitation"],
+        description="Параметры погоды, которые нужно присылать"
+    ),
+    database: Database = Depends(get_database)
+):
+    """
+    Подписка на обновления прогнозов городов пользователя (или общих городов) через Server-Sent Events
+    вместо периодического опроса GET /cities/{city_name}. Список городов фиксируется при подключении
+    """
+    selected_columns = [param for param in weather_params if param in WEATHER_COLUMNS]
+    if not selected_columns:
+        return JSONResponse(status_code=400, content={"message": "Некорректные параметры погоды"})
+    if city_names is not None and "all" in city_names:
+        city_names = None
+
+    try:
+        async with database.reader() as db:
+            locations, error = await _batch_locations(db, user_id, city_names and list(dict.fromkeys(city_names)))
+        if error:
+            return error
+    except aiosqlite.Error as e:
+        return JSONResponse(status_code=500, content={"message": f"Ошибка базы данных: {str(e)}"})
+
+    subscription = forecast_updates.subscribe(locations.values())
+    return StreamingResponse(_forecast_events(subscription, locations, selected_columns, SSE_KEEPALIVE),
+                             media_type="text/event-stream",
+                             headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"})
+
+
+async def _city_location(db, city_name, user_id):
+    """
+    Ищет location_id города пользователя (user_id!=None) или общего города.
+    Возвращает (location_id, None) или (None, JSONResponse с ошибкой 404)
+    """
+    if user_id!=None:
+        async with db.execute('SELECT * FROM users WHERE id = ?', (user_id,)) as cursor:
+            user_exists = await cursor.fetchone()
+
+        if not user_exists:
+            return None, JSONResponse(status_code=404,content={"message": f"Пользователь с ID {user_id} не существует."})
+
+        query_city = '''
+            SELECT location_id 
+            FROM cities 
+            WHERE city_name = ? AND user_id = ? 
+        '''
+        async with db.execute(query_city, (city_name, user_id)) as cursor:
+            city_info = await cursor.fetchone()
+
+    else:
+        query_city = '''
+            SELECT location_id 
+            FROM cities 
+            WHERE city_name = ? AND user_id is NULL
+        '''
+        async with db.execute(query_city, (city_name,)) as cursor:
+            city_info = await cursor.fetchone()
+
+    if not city_info:
+        return None, JSONResponse(status_code=404, content={"message": f"Город {city_name} не отслеживается"})
+    return city_info[0], None
+
+
+def _parse_time(value, day):
+    """
+    Время 'HH:MM' или 'HH:MM:SS' на дату day
+    """
+    time_format = "%H:%M:%S" if value.count(':') == 2 else "%H:%M"
+    return datetime.combine(day, datetime.strptime(value, time_format).time())
+
+
+def _range_bound(value, day, default):
+    """
+    Граница диапазона: время 'HH:MM' или 'HH:MM:SS' на дату day либо дата и время в формате ISO
+    """
+    if value is None:
+        return default
+    if len(value) <= 8:
+        return _parse_time(value, day)
+    return datetime.fromisoformat(value)
+
+
+def _interpolate(moment, before, after, method):
+    """
+    Значения на момент moment по ближайшим слотам before и after - (datetime, {колонка: значение}) или None.
+    Учитываются только слоты не дальше одного шага SLOT_MINUTES от moment.
+    method='linear' интерполирует между соседними слотами, 'nearest' берёт ближайший
+    """
+    tolerance = timedelta(minutes=SLOT_MINUTES)
+    candidates = [point for point in (before, after) if point is not None and abs(point[0] - moment) <= tolerance]
+    if not candidates:
+        return None
+    nearest = min(candidates, key=lambda point: abs(point[0] - moment))[1]
+    if method != "linear" or len(candidates) < 2 or before[0] == after[0]:
+        return nearest
+
+    weight = (moment - before[0]) / (after[0] - before[0])
+    return {
+        column: nearest[column] if before[1][column] is None or after[1][column] is None
+        else before[1][column] + (after[1][column] - before[1][column]) * weight
+        for column in nearest
+    }
+
+
+def _snapshot_value(snapshot, location_id, moment, selected_columns, method):
+    """
+    Значения на момент moment из снимка или None, если нужных слотов в снимке нет
+    """
+    minutes = moment.hour * 60 + moment.minute + moment.second / 60
+    before_slot = int(minutes // SLOT_MINUTES)
+    after_slot = before_slot if minutes % SLOT_MINUTES == 0 else before_slot + 1
+    if after_slot >= SLOTS_PER_DAY:
+        return None
+
+    before = snapshot.values(location_id, before_slot, selected_columns)
+    after = snapshot.values(location_id, after_slot, selected_columns)
+    if before is None or after is None:
+        return None
+
+    day_start = datetime.combine(snapshot.day, datetime.min.time())
+    return _interpolate(
+        moment,
+        (day_start + timedelta(minutes=before_slot * SLOT_MINUTES), before),
+        (day_start + timedelta(minutes=after_slot * SLOT_MINUTES), after),
+        method,
+    )
+
+
+async def _db_value(db, location_id, moment, selected_columns, method):
+    """
+    Значения на момент moment по соседним слотам из хранилища. Читается только
+    окно в один шаг SLOT_MINUTES по обе стороны от moment
+    """
+    tolerance = timedelta(minutes=SLOT_MINUTES)
+    records = await storage.read_range(db, location_id, moment - tolerance, moment + tolerance, selected_columns)
+    return _records_value(records, moment, selected_columns, method)
+
+
+def _records_value(records, moment, selected_columns, method):
+    """
+    Значения на момент moment по записям (timestamp, *значения) окна вокруг moment
+    """
+    points = [(datetime.fromisoformat(record[0]), dict(zip(selected_columns, record[1:]))) for record in records]
+    before = next((point for point in reversed(points) if point[0] <= moment), None)
+    after = next((point for point in points if point[0] >= moment), None)
+    return _interpolate(moment, before, after, method)
+
+
+async def _city_series(db, city_name, user_id, day, time_from, time_to, step, selected_columns):
+    """
+    Возвращает ряд значений за диапазон, прочитанный из хранилища storage одним запросом по индексу.
+    Если 15-минутных данных за диапазон уже нет (история сжата), берутся часовые агрегаты.
+    Ответ собирается по колонкам: {"timestamp": [...], "temperature": [...], ...}
+    """
+    if step <= 0 or step % SLOT_MINUTES:
+        return JSONResponse(status_code=400, content={"message": f"Шаг должен быть кратен {SLOT_MINUTES} минутам"})
+    try:
+        start = _range_bound(time_from, day, datetime.combine(day, datetime.min.time()))
+        end = _range_bound(time_to, day, datetime.combine(day, datetime.max.time().replace(microsecond=0)))
+    except ValueError:
+        return JSONResponse(status_code=400, content={"message": "Некорректный формат времени диапазона"})
+    if start > end:
+        return JSONResponse(status_code=400, content={"message": "Начало диапазона позже его конца"})
+
+    location_id, error = await _city_location(db, city_name, user_id)
+    if error:
+        return error
+    if not selected_columns:
+        return JSONResponse(status_code=400, content={"message": "Некорректные параметры погоды"})
+
+    records = await storage.read_range(db, location_id, start, end, selected_columns)
+    if not records:
+        records = await storage.read_hourly_range(db, location_id, start, end, selected_columns)
+
+    if step != SLOT_MINUTES and records:
+        first = datetime.fromisoformat(records[0][0])
+        records = [
+            record for record in records
+            if (datetime.fromisoformat(record[0]) - first).total_seconds() // 60 % step == 0
+        ]
+
+    if not records:
+        return JSONResponse(status_code=404, content={"message": f"Данные о погоде в городе {city_name} отсутствуют в базе данных"})
+
+    columns = list(zip(*records))
+    result = {"city_name": city_name, "timestamp": list(columns[0])}
+    result.update({param: list(values) for param, values in zip(selected_columns, columns[1:])})
+    return JSONResponse(status_code=200, content=result)
+
+
+@router.get('/{city_name}/status')
+async def city_status(city_name: str = Path(..., description="Название города"),
+                      user_id: Optional[str] = Query(None, description="ID пользователя (необязательно)"),
+                      database: Database = Depends(get_database)):
+    """
+    Возвращает состояние загрузки прогноза города: queued, running, done или failed.
+    Если город в фоновую очередь не ставился, done означает, что прогноз уже есть в БД,
+    а pending - что он будет получен при ближайшем плановом обновлении
+    """
+    try:
+        async with database.reader() as db:
+            location_id, error = await _city_location(db, city_name, user_id)
+            if error:
+                return error
+
+            status = backfill.status(location_id)
+            if status is None:
+                async with db.execute('SELECT forecast_hash FROM locations WHERE id = ?', (location_id,)) as cursor:
+                    row = await cursor.fetchone()
+                status = "done" if row and row[0] is not None else "pending"
+
+        return JSONResponse(status_code=200,
+                            content={"city_name": city_name, "location_id": location_id, "weather_status": status},
+                            headers={"Cache-Control": "no-store"})
+    except aiosqlite.Error as e:
+        return JSONResponse(status_code=500, content={"message": f"Ошибка базы данных: {str(e)}"})
+    except Exception as e:
+        return JSONResponse(status_code=500, content={"message": f"Неизвестная ошибка: {str(e)}"})
+
+
 @router.get('/{city_name}')
 async def city(
     city_name: str = Path(..., description="Название города"),
     user_id: Optional[str] = Query(None, description="ID пользователя (необязательно)"),
-    time: str = Query(..., description="Время для прогноза в формате 'HH:MM:SS'"),
+    time: Optional[str] = Query(None, description="Время для прогноза в формате 'HH:MM:SS' (не обязательно кратное 15 минутам). Если не указано, возвращается ряд за диапазон from-to"),
+    day: Optional[str] = Query(None, alias="date", description="Дата в формате 'YYYY-MM-DD' (по умолчанию сегодня)"),
+    time_from: Optional[str] = Query(None, alias="from", description="Начало диапазона: 'HH:MM:SS' на дату date или 'YYYY-MM-DDTHH:MM:SS' (по умолчанию начало дня)"),
+    time_to: Optional[str] = Query(None, alias="to", description="Конец диапазона включительно (по умолчанию конец дня)"),
+    step: int = Query(SLOT_MINUTES, description="Шаг ряда в минутах, кратный 15"),
+    method: str = Query("linear", description="Как получить значение между слотами: 'linear' (интерполяция) или 'nearest' (ближайший слот)"),
     weather_params: Optional[List[str]] = Query(
         ["temperature", "surface_pressure", "wind_speed", "precipitation"],
         description="Параметры погоды, которые нужно вернуть (доступны: температура, влажность, скорость ветра, осадки)"
-    )
+    ),
+    database: Database = Depends(get_database)
 ):
     """
-    Возвращает данные города из общего списка городов или из списка пользователя (user_id!=None)
+    Возвращает данные города из общего списка городов или из списка пользователя (user_id!=None):
+    значение на время time или, если time не указан, ряд значений за диапазон.
+    Если time попадает между 15-минутными слотами, значение берётся из ближайшего слота
+    или линейно интерполируется между соседними (method).
+    Если город и слоты есть в снимке сегодняшних прогнозов, ответ собирается без обращения к БД
     """
-    try:
-        async with aiosqlite.connect(DB_ROUTE) as db:
-            if user_id!=None:
-                async with db.execute('SELECT * FROM users WHERE id = ?', (user_id,)) as cursor:
-                    user_exists = await cursor.fetchone()
+    selected_columns = [param for param in weather_params if param in WEATHER_COLUMNS]
 
-                if not user_exists:
-                    return JSONResponse(status_code=404,content={"message": f"Пользователь с ID {user_id} не существует."})
+    if method not in ("linear", "nearest"):
+        return JSONResponse(status_code=400, content={"message": "Параметр method должен быть 'linear' или 'nearest'"})
 
-                query_city = '''
-                    SELECT id 
-                    FROM cities 
-                    WHERE city_name = ? AND user_id = ? 
-                '''
-                async with db.execute(query_city, (city_name, user_id)) as cursor:
-                    city_info = await cursor.fetchone()
+    try:
+        current_date = datetime.strptime(day, "%Y-%m-%d").date() if day else datetime.now().date()
+    except ValueError:
+        return JSONResponse(status_code=400, content={"message": "Некорректный формат даты"})
 
-            else:
-                query_city = '''
-                    SELECT id 
-                    FROM cities 
-                    WHERE city_name = ? AND user_id is NULL
-                '''
-                async with db.execute(query_city, (city_name,)) as cursor:
-                    city_info = await cursor.fetchone()
+    try:
+        if time is None:
+            async with database.reader() as db:
+                return await _city_series(db, city_name, user_id, current_date, time_from, time_to, step, selected_columns)
 
-            if not city_info:
-                return JSONResponse(status_code=404, content={"message": f"Город {city_name} не отслеживается"})
+        try:
+            moment = _parse_time(time, current_date)
+        except ValueError:
+            moment = None
 
-            city_id = city_info[0]
-            current_date = datetime.now().date()
-            query_time = f"{current_date} {time}"
+        snapshot = forecast_snapshot.current()
+        if snapshot is not None and moment is not None and snapshot.day == current_date:
+            location_id = snapshot.location_id(user_id, city_name)
+            if location_id is not None:
+                if not selected_columns:
+                    return JSONResponse(status_code=400, content={"message": "Некорректные параметры погоды"})
+                result = _snapshot_value(snapshot, location_id, moment, selected_columns, method)
+                if result is not None:
+                    return JSONResponse(status_code=200, content=result)
 
-            selected_columns = [param for param in weather_params if param in ["temperature", "surface_pressure", "wind_speed", "precipitation"]]
+        async with database.reader() as db:
+            location_id, error = await _city_location(db, city_name, user_id)
+            if error:
+                return error
 
             if not selected_columns:
                 return JSONResponse(status_code=400, content={"message": "Некорректные параметры погоды"})
 
-            query_weather = f'''
-                SELECT {", ".join(selected_columns)} 
-                FROM weather_data 
-                WHERE city_id = ? AND timestamp = ?
-            '''
-            async with db.execute(query_weather, (city_id, query_time)) as cursor:
-                weather_record = await cursor.fetchone()
-
+            result = None
+            if moment is not None:
+                result = await _db_value(db, location_id, moment, selected_columns, method)
 
-            if weather_record:
-                result = {param: value for param, value in zip(weather_params, weather_record)}
+            if result is not None:
                 return JSONResponse(status_code=200, content=result)
             else:
                 return JSONResponse(status_code=404, content={"message": f"Данные о погоде в городе {city_name} отсутствуют в базе данных"})
@@ -1,20 +1,21 @@
 import aiosqlite
 
-from fastapi import APIRouter, Query
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Query, Depends
 
-from settings import DB_ROUTE
+from app.db import Database, get_database
+from app.responses import JSONResponse
 
 
 router = APIRouter()
 
 @router.post("/register")
-async def register_user(name: str = Query(..., description="Имя пользователя")):
+async def register_user(name: str = Query(..., description="Имя пользователя"),
+                        database: Database = Depends(get_database)):
     """
     Регистрирует пользователя по имени или возвращает существующего
     """
     try:
-        async with aiosqlite.connect(DB_ROUTE) as db:
+        async with database.writer() as db:
             async with db.execute("SELECT id FROM users WHERE name = ?", (name,)) as cursor:
                 user = await cursor.fetchone()
 
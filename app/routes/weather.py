@@ -1,19 +1,28 @@
-import json
-
-import aiohttp
 from fastapi import APIRouter, Query
-from fastapi.responses import JSONResponse
+from pydantic import ValidationError
 
+from app.cache import TTLCache
+from app.models import current_adapter
+from app.responses import JSONResponse
 from app.service import get_weather
+from app.upstream import open_meteo, UpstreamError, UpstreamStatusError
+from settings import CURRENT_CACHE_TTL, CURRENT_CACHE_MAXSIZE, CURRENT_CACHE_PRECISION
 
 
 router = APIRouter()
 
-@router.get('/current')
-async def get_weather_by_coords(latitude: float = Query(..., description="Широта"),
-                                longitude: float = Query(..., description="Долгота")):
+current_weather_cache = TTLCache(maxsize=CURRENT_CACHE_MAXSIZE, ttl=CURRENT_CACHE_TTL)
+
+
+class CurrentWeatherNotFound(LookupError):
+    """
+    В ответе api нет блока current
+    """
+
+
+async def fetch_current_weather(latitude, longitude):
     """
-    С помощью get_weather возвращает погоду по координатам
+    С помощью get_weather получает текущую погоду по координатам
     """
     params = {
         'latitude': latitude,
@@ -21,29 +30,68 @@ async def get_weather_by_coords(latitude: float = Query(..., description="Шир
         'current': 'temperature_2m,surface_pressure,wind_speed_10m',
     }
 
+    response = await get_weather(params)
+    if isinstance(response, JSONResponse):
+        raise UpstreamStatusError(response.status_code)
+    response = current_adapter.validate_json(response)
+
+    if 'current' not in response:
+        raise CurrentWeatherNotFound()
+
+    current = response['current']
+    return {
+        'temperature': current['temperature_2m'],
+        'wind_speed': current['wind_speed_10m'],
+        'surface_pressure': current['surface_pressure']
+    }
+
+
+@router.get('/current')
+async def get_weather_by_coords(latitude: float = Query(..., description="Широта"),
+                                longitude: float = Query(..., description="Долгота")):
+    """
+    Возвращает погоду по координатам. Ответы кешируются в памяти на CURRENT_CACHE_TTL секунд
+    по координатам, округлённым до CURRENT_CACHE_PRECISION знаков.
+    Если api временно недоступно или автомат разомкнут, отдаётся устаревшая запись кеша
+    с заголовком X-Cache-Status: stale
+    """
+    latitude = round(latitude, CURRENT_CACHE_PRECISION)
+    longitude = round(longitude, CURRENT_CACHE_PRECISION)
+    key = (latitude, longitude)
+
     try:
-        response = await get_weather(params)
-        response = json.loads(response)
-
-        if 'current' not in response:
-            return JSONResponse(status_code=404, content={'message': "Current weather data not found"})
-
-        temperature = response['current']['temperature_2m']
-        wind_speed = response['current']['wind_speed_10m']
-        surface_pressure = response['current']['surface_pressure']
-        
-        weather_data = {
-            'temperature': temperature,
-            'wind_speed': wind_speed,
-            'surface_pressure': surface_pressure
-        }
+        weather_data = await current_weather_cache.get_or_load(
+            key, lambda: fetch_current_weather(latitude, longitude)
+        )
         return JSONResponse(status_code=200, content=weather_data)
 
-    except json.JSONDecodeError:
+    except CurrentWeatherNotFound:
+        return JSONResponse(status_code=404, content={'message': "Current weather data not found"})
+
+    except ValidationError:
         return JSONResponse(status_code=500, content={'message': "Failed to decode the response from the weather service"})
-    
-    except aiohttp.ClientError as e:
+
+    except UpstreamError as e:
+        stale = current_weather_cache.get_stale(key) if e.transient else None
+        if stale is not None:
+            return JSONResponse(status_code=200, content=stale, headers={'X-Cache-Status': 'stale'})
         return JSONResponse(status_code=500, content={'message': f"Request to weather service failed: {str(e)}"})
     
     except Exception as e:
-        return JSONResponse(status_code=500, content={'message': f"An unexpected error occurred: {str(e)}"})
\ No newline at end of file
+        return JSONResponse(status_code=500, content={'message': f"An unexpected error occurred: {str(e)}"})
+
+
+@router.get('/cache_stats')
+async def cache_stats():
+    """
+    Возвращает счётчики попаданий и промахов кеша /weather/current
+    """
+    return JSONResponse(status_code=200, content=current_weather_cache.stats())
+
+
+@router.get('/upstream_stats')
+async def upstream_stats():
+    """
+    Возвращает счётчики запросов к api.open-meteo.com и состояние автомата
+    """
+    return JSONResponse(status_code=200, content=open_meteo.stats())
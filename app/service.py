@@ -1,75 +1,407 @@
-import json
-from datetime import datetime
+import time
+import asyncio
+import hashlib
+from datetime import datetime, timedelta
 
-import aiosqlite
-import aiohttp
-from fastapi.responses import JSONResponse
+from app import upstream
+from app.db import database
+from app.ingest import ingest
+from app.models import forecast_adapter, forecast_list_adapter
+from app.responses import JSONResponse
+from app.snapshot import refresh_snapshot, bump_generation
+from app.storage import storage
+from app.upstream import UpstreamStatusError
+from settings import REFRESH_CONCURRENCY, REFRESH_BATCH_SIZE, FORECAST_DAYS, REFRESH_TIME, REFRESH_SHARDS
+
+last_refresh_stats = {}
 
-from settings import DB_ROUTE
 
 async def get_weather(params):
     """
-    Делает запрос на api.open-meteo.com и возвращает ответ
+    Делает запрос на api.open-meteo.com через клиент upstream.open_meteo (ограничение частоты,
+    повторы с задержкой, автомат) и возвращает тело ответа в байтах, которые вызывающий код
+    разбирает сразу через validate_json без промежуточной строки.
+    Если api ответило ошибкой, возвращает JSONResponse с её статусом. Недоступность api
+    и разомкнутый автомат выбрасываются как UpstreamError
+    """
+    try:
+        return await upstream.open_meteo.get(params)
+    except UpstreamStatusError as e:
+        return JSONResponse(status_code=e.status, content={'message': str(e)})
+
+
+async def fetch_locations_body(locations):
+    """
+    Одним запросом получает прогноз minutely_15 на FORECAST_DAYS дней начиная с сегодня
+    для пачки локаций и возвращает тело ответа в байтах без разбора
+    """
+    today = datetime.today().date()
+    params = {
+        'latitude': ','.join(str(latitude) for _, latitude, _ in locations),
+        'longitude': ','.join(str(longitude) for _, _, longitude in locations),
+        'minutely_15': 'temperature_2m,surface_pressure,wind_speed_10m,precipitation',
+        'start_date': str(today),
+        'end_date': str(today + timedelta(days=FORECAST_DAYS - 1))
+    }
+
+    weather_data = await get_weather(params)
+    if isinstance(weather_data, JSONResponse):
+        raise RuntimeError(f"api.open-meteo.com ответил статусом {weather_data.status_code}")
+    return weather_data
+
+
+def decode_locations_weather(locations, body):
+    """
+    Разбирает ответ api для пачки локаций и возвращает список (location_id, данные) в том же порядке
+    """
+    forecasts = parse_forecasts(body)
+    if len(forecasts) != len(locations):
+        raise RuntimeError(f"Ожидалось {len(locations)} прогнозов, получено {len(forecasts)}")
+
+    return [(location_id, forecast) for (location_id, _, _), forecast in zip(locations, forecasts)]
+
+
+async def fetch_locations_weather(locations):
+    """
+    Получает и разбирает прогнозы пачки локаций, возвращает список (location_id, данные)
+    """
+    return decode_locations_weather(locations, await fetch_locations_body(locations))
+
+
+def parse_forecasts(body):
+    """
+    Разбирает ответ api с прогнозами из байтов и проверяет его структуру.
+    Для одной локации api отдаёт объект, а не список, поэтому схема выбирается по первому символу
+    """
+    if body.lstrip()[:1] in (b'[', '['):
+        return forecast_list_adapter.validate_json(body)
+    return [forecast_adapter.validate_json(body)]
+
+
+def next_due(location_id, now):
+    """
+    Время (unix) следующего планового обновления локации. Локации делятся на REFRESH_SHARDS
+    шардов по location_id, и каждый шард обновляется раз в REFRESH_TIME минут со своим сдвигом,
+    поэтому обновления равномерно распределены по интервалу
     """
-    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10)) as session:
-        async with session.get('https://api.open-meteo.com/v1/forecast', params=params) as resp:
+    interval = REFRESH_TIME * 60
+    phase = (location_id % REFRESH_SHARDS) * interval / REFRESH_SHARDS
+    return now - (now - phase) % interval + interval
+
+
+def _batches(locations, size):
+    """
+    Делит список локаций на пачки по size штук
+    """
+    for start in range(0, len(locations), size):
+        yield locations[start:start + size]
+
+
+def _to_timestamp(time):
+    """
+    Переводит время api ('2025-01-01T10:00') в формат колонки timestamp ('2025-01-01 10:00:00')
+    """
+    if len(time) == 16:
+        return time.replace('T', ' ') + ':00'
+    return str(datetime.fromisoformat(time))
+
+
+def build_weather_rows(location_id, weather_data):
+    """
+    За один проход собирает кортежи строк weather_data из массивов minutely_15
+    """
+    minutely_15 = weather_data['minutely_15']
+    return [
+        (location_id, _to_timestamp(time), temperature, surface_pressure, wind_speed, precipitation)
+        for time, temperature, surface_pressure, wind_speed, precipitation in zip(
+            minutely_15['time'],
+            minutely_15['temperature_2m'],
+            minutely_15['surface_pressure'],
+            minutely_15['wind_speed_10m'],
+            minutely_15['precipitation'],
+        )
+    ]
+
+
+def forecast_hash(rows):
+    """
+    Хеш содержимого прогноза локации, по нему пропускаются неизменившиеся прогнозы.
+    В хеш входит имя хранилища: после смены WEATHER_STORAGE прогнозы записываются
+    в новое хранилище, а не пропускаются как уже сохранённые
+    """
+    return hashlib.blake2b(repr((storage.name, rows)).encode(), digest_size=16).hexdigest()
+
+
+async def write_location_weather(db, location_id, weather_data):
+    """
+    Записывает свежий прогноз локации через хранилище storage (app/storage.py)
+    и возвращает (записано строк, пропущено строк).
+
+    Если хеш прогноза совпадает с сохранённым, локация пропускается целиком.
+    Иначе хранилище пишет только изменившиеся слоты. Запись идёт внутри savepoint,
+    поэтому при ошибке данные локации остаются прежними. Если транзакция ещё не открыта,
+    она открывается здесь: иначе SAVEPOINT начал бы собственную транзакцию, а RELEASE её закоммитил.
+    Фиксирует изменения вызывающий код
+    """
+    rows = build_weather_rows(location_id, weather_data)
+    if not rows:
+        return 0, 0
+    content_hash = forecast_hash(rows)
+
+    async with db.execute('SELECT forecast_hash FROM locations WHERE id = ?', (location_id,)) as cursor:
+        stored_hash = await cursor.fetchone()
+    if stored_hash and stored_hash[0] == content_hash:
+        return 0, len(rows)
+
+    if not db.in_transaction:
+        await db.execute('BEGIN')
+    await db.execute('SAVEPOINT write_location')
+    try:
+        written, skipped = await storage.write(db, location_id, rows)
+        await db.execute('UPDATE locations SET forecast_hash = ? WHERE id = ?', (content_hash, location_id))
+    except Exception:
+        await db.execute('ROLLBACK TO write_location')
+        raise
+    finally:
+        await db.execute('RELEASE write_location')
+    return written, skipped
+
+
+async def _fetch_worker(batches, queue):
+    """
+    Берёт пачки локаций из общего итератора и кладёт полученные прогнозы в очередь записи.
+    Если запущен процесс записи (app/ingest.py), в очередь кладётся неразобранный ответ
+    вместе с пачкой, а разбор выполняется уже в том процессе.
+    Ошибка одной пачки логируется и не прерывает обработку остальных
+    """
+    for batch in batches:
+        try:
+            if ingest.is_running:
+                await queue.put((batch, await fetch_locations_body(batch)))
+                continue
+            forecasts = await fetch_locations_weather(batch)
+        except Exception as e:
+            print(f"Ошибка при получении погоды для локаций с ID {[location[0] for location in batch]}: {e}")
+            continue
+        for item in forecasts:
+            await queue.put(item)
+
+
+def _new_write_stats():
+    return dict.fromkeys(('locations_updated', 'locations_skipped', 'locations_failed', 'rows_written', 'rows_skipped'), 0)
+
+
+async def _write_forecasts(pool, forecasts):
+    """
+    Одной транзакцией через соединение на запись пула pool записывает прогнозы (location_id, данные)
+    и возвращает список location_id, у которых изменились данные, список всех записанных
+    (в том числе без изменений) location_id и счётчики транзакции. Записанным локациям в той же
+    транзакции назначается время следующего обновления (next_due), а изменившимся - новое поколение
+    данных, по которому их находят остальные процессы. Транзакция открывается явно до первой локации,
+    поэтому savepoint'ы локаций вложены в неё, и при ошибке на любом шаге, включая commit,
+    не остаётся ни строк прогнозов, ни их хешей
+    """
+    stats = _new_write_stats()
+    updated = []
+    stored = []
+    async with pool.writer() as db:
+        if not db.in_transaction:
+            await db.execute('BEGIN')
+        now = time.time()
+        schedule = []
+        for location_id, weather_data in forecasts:
             try:
-                if resp.status != 200:
-                    return JSONResponse(status_code=resp.status, content={'message': f"Error fetching weather data: {resp.status}"})
-                return await resp.text()
-            except aiohttp.ClientError as e:
-                return JSONResponse(status_code=500, content={'message': f"Request failed: {str(e)}"})
+                written, skipped = await write_location_weather(db, location_id, weather_data)
+            except Exception as e:
+                stats['locations_failed'] += 1
+                print(f"Ошибка при записи погоды для локации с ID {location_id}: {e}")
+                continue
+            stats['rows_written'] += written
+            stats['rows_skipped'] += skipped
+            stored.append(location_id)
+            schedule.append((next_due(location_id, now), location_id))
+            if written:
+                stats['locations_updated'] += 1
+                updated.append(location_id)
+            else:
+                stats['locations_skipped'] += 1
+        await db.executemany('UPDATE locations SET next_due_at = ? WHERE id = ?', schedule)
+        if updated:
+            generation = await bump_generation(db)
+            await db.executemany('UPDATE locations SET data_generation = ? WHERE id = ?',
+                                 [(generation, location_id) for location_id in updated])
+        await db.commit()
+    return updated, stored, stats
+
+
+async def ingest_fetched(pool, fetched):
+    """
+    Выполняется в процессе записи: разбирает ответы api (пачка, тело ответа) и записывает
+    прогнозы через соединение процесса. Возвращает изменившиеся и записанные location_id
+    и счётчики. Пачка с неверным ответом логируется и пропускается
+    """
+    forecasts = []
+    for batch, body in fetched:
+        try:
+            forecasts.extend(decode_locations_weather(batch, body))
+        except Exception as e:
+            print(f"Ошибка при разборе погоды для локаций с ID {[location[0] for location in batch]}: {e}")
+    return await _write_forecasts(pool, forecasts)
+
+
+async def _write_worker(queue, stats):
+    """
+    Записывает прогнозы из очереди в БД, пока не получит None, и возвращает
+    список location_id, у которых изменились данные, и список всех записанных
+    (в том числе без изменений) location_id. Всё, что успело накопиться
+    в очереди, пишется одной транзакцией, а соединение на запись берётся только
+    на время этой транзакции. Если запущен процесс записи, накопленные ответы
+    разбираются и пишутся в нём (ingest_fetched), а основной процесс только ждёт результат.
+    Очередь ограничена, поэтому пока идёт запись, получение новых ответов приостанавливается.
+
+    Если транзакция не удалась (например, БД заблокирована дольше busy_timeout), её локации
+    считаются не полученными, а очередь разбирается дальше до None: иначе задачи получения
+    навсегда остановились бы на заполненной очереди
+    """
+    updated = []
+    stored = []
+    finished = False
+    while not finished:
+        items = [await queue.get()]
+        while not queue.empty():
+            items.append(queue.get_nowait())
+        if None in items:
+            finished = True
+            items = [item for item in items if item is not None]
+        if not items:
+            continue
+
+        try:
+            if ingest.is_running:
+                batch_updated, batch_stored, batch_stats = await ingest.run(ingest_fetched, items)
+            else:
+                batch_updated, batch_stored, batch_stats = await _write_forecasts(database, items)
+        except Exception as e:
+            print(f"Ошибка при записи пачки погоды ({len(items)} в очереди): {e}")
+            continue
+        for key, value in batch_stats.items():
+            stats[key] += value
+        updated.extend(batch_updated)
+        stored.extend(batch_stored)
+    return updated, stored
+
+
+async def _refresh_locations(locations, partial):
+    """
+    Запрашивает и записывает прогнозы локаций (id, latitude, longitude) и публикует снимок.
+    При partial в снимке перечитываются только изменившиеся локации.
+    Возвращает счётчики цикла и список location_id, прогноз которых записан
+    """
+    stats = _new_write_stats()
+    stats['locations'] = len(locations)
+    queue = asyncio.Queue(maxsize=REFRESH_CONCURRENCY)
+    writer = asyncio.create_task(_write_worker(queue, stats))
+
+    batches = list(_batches(locations, REFRESH_BATCH_SIZE))
+    batches_iter = iter(batches)
+    await asyncio.gather(*(_fetch_worker(batches_iter, queue) for _ in range(min(REFRESH_CONCURRENCY, len(batches)))))
+    await queue.put(None)
+    updated, stored = await writer
+    stats['locations_failed'] += len(locations) - sum(stats[key] for key in ('locations_updated', 'locations_skipped', 'locations_failed'))
+
+    await refresh_snapshot(updated if partial else None)
+
+    last_refresh_stats.clear()
+    last_refresh_stats.update(stats)
+    return stats, stored
 
 
 async def upd_data_to_db(city_name=None):
     """
-    Обновляет данные всех городов (city=None) или одного города (city = city_name)
+    Обновляет данные всех городов (city=None) или одного города (city = city_name).
+
+    Прогноз запрашивается и хранится один раз на локацию, даже если её отслеживают
+    несколько городов. Локации группируются в пачки по REFRESH_BATCH_SIZE на один
+    запрос к api, пачки запрашиваются параллельно не более чем REFRESH_CONCURRENCY
+    запросами, а запись в БД идёт отдельной задачей по мере поступления ответов.
+    Пишутся только изменившиеся слоты (write_location_weather).
+    После записи публикуется новый снимок сегодняшних прогнозов (app/snapshot.py).
+
+    Возвращает счётчики цикла: сколько локаций обновлено, пропущено без изменений
+    и не получено, сколько строк записано и пропущено
     """
     try:
-        async with aiosqlite.connect(DB_ROUTE) as db:
+        async with database.reader() as db:
             if not city_name:
-                async with db.execute('SELECT id, latitude, longitude FROM cities') as cursor:
-                    cities = await cursor.fetchall()
+                query = '''
+                    SELECT id, latitude, longitude
+                    FROM locations
+                    WHERE id IN (SELECT location_id FROM cities)
+                '''
+                async with db.execute(query) as cursor:
+                    locations = await cursor.fetchall()
 
             else:
-                async with db.execute('SELECT id, latitude, longitude FROM cities WHERE city_name = ? ', (city_name,)) as cursor:
-                    cities = await cursor.fetchall()
-
-            for city in cities:
-                city_id, latitude, longitude = city
-                params = {
-                    'latitude': latitude,
-                    'longitude': longitude,
-                    'minutely_15': 'temperature_2m,surface_pressure,wind_speed_10m,precipitation',
-                    'start_date': str(datetime.today().date()),
-                    'end_date': str(datetime.today().date())
-                }
-
-                weather_data = await get_weather(params)
-                weather_data = json.loads(weather_data)
-
-                times = weather_data['minutely_15']['time']
-                temperatures = weather_data['minutely_15']['temperature_2m']
-                surface_pressures = weather_data['minutely_15']['surface_pressure']
-                wind_speeds = weather_data['minutely_15']['wind_speed_10m']
-                precipitations = weather_data['minutely_15']['precipitation']
-
-                await db.execute('''DELETE FROM weather_data WHERE city_id = ? AND DATE(timestamp) = ?''', (city_id, datetime.today().date()))
-
-                for time, temperature, surface_pressure, wind_speed, precipitation in zip(
-                    times, temperatures, surface_pressures, wind_speeds, precipitations
-                ):
-                    forecast_time = datetime.fromisoformat(time)
-                    await db.execute('''
-                        INSERT INTO weather_data (city_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
-                        VALUES (?, ?, ?, ?, ?, ?)
-                    ''', (city_id, forecast_time, temperature, surface_pressure, wind_speed, precipitation))
-
-            await db.commit()
-            if city_name:
-                print(f'Данные погоды в городе {city_name} добавлены')
-            else:
-                print(f'Данные погоды во всех отслеживаемых городах обновлены')
+                query = '''
+                    SELECT id, latitude, longitude
+                    FROM locations
+                    WHERE id IN (SELECT location_id FROM cities WHERE city_name = ?)
+                '''
+                async with db.execute(query, (city_name,)) as cursor:
+                    locations = await cursor.fetchall()
+
+        stats, _ = await _refresh_locations(locations, partial=bool(city_name))
+        if city_name:
+            print(f'Данные погоды в городе {city_name} добавлены: {stats}')
+        else:
+            print(f'Данные погоды обновлены: {stats}')
+        return stats
+
+    except Exception as e:
+        print(f"Ошибка при обновлении данных в базе: {e}")
+
+
+async def upd_locations_to_db(location_ids):
+    """
+    Обновляет прогнозы только переданных локаций, например только что добавленных городов.
+    Возвращает множество location_id, прогноз которых получен и записан
+    """
+    placeholders = ','.join('?' * len(location_ids))
+    async with database.reader() as db:
+        async with db.execute(f'SELECT id, latitude, longitude FROM locations WHERE id IN ({placeholders})',
+                              list(location_ids)) as cursor:
+            locations = await cursor.fetchall()
+
+    stats, stored = await _refresh_locations(locations, partial=True)
+    print(f'Данные погоды для локаций {list(location_ids)} получены: {stats}')
+    return set(stored)
+
+
+async def refresh_due_locations():
+    """
+    Плановое обновление: запускается планировщиком REFRESH_SHARDS раз за REFRESH_TIME минут
+    и обновляет только локации, у которых наступило время next_due_at (или оно ещё не назначено).
+    Локации, которые не удалось обновить, остаются к обновлению и берутся следующим запуском.
+
+    Запуск, пришедшийся на ещё не закончившийся предыдущий, планировщик пропускает, а не ставит в очередь
+    """
+    try:
+        async with database.reader() as db:
+            query = '''
+                SELECT id, latitude, longitude
+                FROM locations
+                WHERE (next_due_at IS NULL OR next_due_at <= ?)
+                  AND id IN (SELECT location_id FROM cities)
+                ORDER BY next_due_at
+            '''
+            async with db.execute(query, (time.time(),)) as cursor:
+                locations = await cursor.fetchall()
+
+        if not locations:
+            return None
+        stats, _ = await _refresh_locations(locations, partial=True)
+        print(f'Данные погоды обновлены для {len(locations)} локаций по расписанию: {stats}')
+        return stats
 
     except Exception as e:
-        print(f"Ошибка при обновлении данных в базе: {e}")
\ No newline at end of file
+        print(f"Ошибка при плановом обновлении данных: {e}")
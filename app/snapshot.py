@@ -0,0 +1,198 @@
+import math
+import asyncio
+from datetime import date
+
+from app.db import database
+from app.pubsub import forecast_updates
+from app.storage import storage
+
+
+class ForecastSnapshot:
+    """
+    Неизменяемый снимок прогнозов на один день.
+
+    cities: (user_id, city_name) -> location_id, user_id хранится строкой или None;
+    series: location_id -> {колонка: массив значений из storage.read_day}, индекс массива -
+    номер 15-минутного слота, отсутствующие значения - NaN
+    """
+    __slots__ = ("day", "generation", "cities", "series")
+
+    def __init__(self, day, generation, cities, series):
+        self.day = day
+        self.generation = generation
+        self.cities = cities
+        self.series = series
+
+    def location_id(self, user_id, city_name):
+        """
+        location_id города пользователя (или общего города) либо None
+        """
+        return self.cities.get((user_id, city_name))
+
+    def values(self, location_id, slot, columns):
+        """
+        Значения колонок в слоте или None, если каких-то данных нет
+        """
+        series = self.series.get(location_id)
+        if series is None:
+            return None
+        result = {}
+        for column in columns:
+            value = series[column][slot]
+            if math.isnan(value):
+                return None
+            result[column] = value if storage.precision is None else round(value, storage.precision)
+        return result
+
+
+_current = None
+_generation = 0
+_listings_generation = 0
+# Пересборки снимка идут по очереди: частичная пересборка берёт ряды из прежнего снимка,
+# и две одновременные потеряли бы изменения друг друга
+_rebuild_lock = asyncio.Lock()
+
+
+def current():
+    """
+    Текущий снимок или None, если он ещё не собран
+    """
+    return _current
+
+
+def generation():
+    """
+    Поколение данных, до которого включительно этот процесс перечитал изменившиеся локации.
+    Счётчик хранится в БД (app_state) и общий для всех процессов: он растёт при каждой записи прогнозов,
+    добавлении городов и сжатии истории. По нему строится ETag ответов.
+
+    Значение из БД принимается, только если прочитано в одной транзакции с выборкой
+    locations.data_generation > прежнего поколения (_rebuild_snapshot): иначе процесс отметил бы
+    как прочитанные чужие изменения, которых нет в его снимке, и больше никогда бы их не перечитал
+    """
+    return _generation
+
+
+async def bump_generation(db):
+    """
+    Увеличивает счётчик поколения в БД и возвращает новое значение. Вызывается внутри транзакции,
+    которая меняет данные; после commit значение передаётся в publish_generation
+    """
+    async with db.execute("UPDATE app_state SET value = value + 1 WHERE key = 'generation' RETURNING value") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+async def publish_generation(value):
+    """
+    Отмечает, что изменения поколения value закоммичены, и публикует текущий снимок под этим поколением.
+    Вызывается после изменений, которые не меняют прогнозы в снимке (города, сжатие истории).
+    Если value следует сразу за известным поколением, снимок только получает новое поколение.
+    Иначе между ними есть чужие изменения, которые процесс ещё не перечитал, и снимок пересобирается
+    с перечитыванием изменившихся локаций
+    """
+    global _current, _generation
+    if value <= _generation:
+        return
+    if value != _generation + 1:
+        await refresh_snapshot([])
+        return
+    _generation = value
+    if _current is not None:
+        _current = ForecastSnapshot(_current.day, _generation, _current.cities, _current.series)
+
+
+def listings_generation():
+    """
+    Последнее известное этому процессу поколение списков городов (app_state, ключ listings).
+    В отличие от поколения данных, растёт только при добавлении городов, а не при каждой записи прогнозов.
+    По нему хранятся готовые ответы /cities/cities
+    """
+    return _listings_generation
+
+
+async def bump_listings_generation(db):
+    """
+    Увеличивает счётчик поколения списков городов в БД и возвращает новое значение.
+    Вызывается внутри транзакции, которая добавляет города; после commit значение передаётся в publish_listings_generation
+    """
+    async with db.execute("UPDATE app_state SET value = value + 1 WHERE key = 'listings' RETURNING value") as cursor:
+        return (await cursor.fetchone())[0]
+
+
+def publish_listings_generation(value):
+    """
+    Отмечает, что города поколения списков value закоммичены
+    """
+    global _listings_generation
+    _listings_generation = max(_listings_generation, value)
+
+
+async def _stored_generation(db, key='generation'):
+    async with db.execute("SELECT value FROM app_state WHERE key = ?", (key,)) as cursor:
+        row = await cursor.fetchone()
+    return row[0] if row else 0
+
+
+async def sync_generation():
+    """
+    Сверяет поколение данных с БД. Если другой процесс записал новые данные, перечитывает
+    в снимок изменившиеся с тех пор локации (locations.data_generation) и города.
+    Так процессы, которые сами погоду не обновляют, узнают о новых данных
+    и городах (добавление города увеличивает оба поколения).
+    Возвращает True, если снимок обновлён
+    """
+    async with database.reader() as db:
+        stored = await _stored_generation(db)
+    if stored <= _generation:
+        return False
+    await refresh_snapshot([])
+    return True
+
+
+async def refresh_snapshot(location_ids=None):
+    """
+    Собирает новый снимок на сегодня и атомарно подменяет текущий, снимок получает поколение из БД.
+    Если переданы location_ids, из БД перечитываются только эти локации и локации, изменившиеся
+    после прежнего поколения снимка, остальные ряды берутся из прежнего снимка того же дня.
+    Подписчики на обновления (app/pubsub.py) получают список перечитанных локаций
+    """
+    async with _rebuild_lock:
+        return await _rebuild_snapshot(location_ids)
+
+
+async def _rebuild_snapshot(location_ids):
+    global _current, _generation, _listings_generation
+    day = date.today()
+    previous = _current
+
+    async with database.reader() as db:
+        # Поколение, выборка изменившихся локаций и их ряды читаются в одной транзакции,
+        # поэтому снимок содержит все изменения до stored включительно
+        await db.execute("BEGIN")
+        try:
+            stored = await _stored_generation(db)
+            stored_listings = await _stored_generation(db, 'listings')
+            async with db.execute("SELECT user_id, city_name, location_id FROM cities") as cursor:
+                cities = {
+                    (None if user_id is None else str(user_id), city_name): location_id
+                    for user_id, city_name, location_id in await cursor.fetchall()
+                }
+
+            if previous is not None and previous.day == day and location_ids is not None:
+                async with db.execute("SELECT id FROM locations WHERE data_generation > ?", (_generation,)) as cursor:
+                    location_ids = set(location_ids).union(row[0] for row in await cursor.fetchall())
+                series = dict(previous.series)
+                for location_id in location_ids:
+                    series.pop(location_id, None)
+                series.update(await storage.read_day(db, day, list(location_ids)))
+            else:
+                location_ids = None
+                series = await storage.read_day(db, day)
+        finally:
+            await db.rollback()
+
+    _generation = max(_generation, stored)
+    _listings_generation = max(_listings_generation, stored_listings)
+    _current = ForecastSnapshot(day, _generation, cities, series)
+    forecast_updates.publish(_generation, location_ids)
+    return _current
@@ -0,0 +1,422 @@
+import sys
+import math
+from abc import ABC, abstractmethod
+from array import array
+from datetime import datetime, timedelta
+
+from settings import WEATHER_STORAGE
+
+WEATHER_COLUMNS = ("temperature", "surface_pressure", "wind_speed", "precipitation")
+SLOT_MINUTES = 15
+SLOTS_PER_DAY = 24 * 60 // SLOT_MINUTES
+SLOTS_PER_HOUR = 60 // SLOT_MINUTES
+
+UPSERT_HOURLY = '''
+    INSERT INTO weather_hourly (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+    VALUES (?, ?, ?, ?, ?, ?)
+    ON CONFLICT(location_id, timestamp) DO UPDATE SET
+        temperature = excluded.temperature,
+        surface_pressure = excluded.surface_pressure,
+        wind_speed = excluded.wind_speed,
+        precipitation = excluded.precipitation
+'''
+
+
+def time_to_slot(time):
+    """
+    Номер 15-минутного слота для времени 'HH:MM:SS' или None, если время не попадает точно в слот
+    """
+    try:
+        parsed = datetime.strptime(time, "%H:%M:%S")
+    except ValueError:
+        return None
+    if parsed.second or parsed.minute % SLOT_MINUTES:
+        return None
+    return parsed.hour * SLOTS_PER_HOUR + parsed.minute // SLOT_MINUTES
+
+
+def slot_timestamp(day, slot):
+    """
+    Значение timestamp ('YYYY-MM-DD HH:MM:SS') для слота slot дня day
+    """
+    return str(datetime.combine(day, datetime.min.time()) + timedelta(minutes=slot * SLOT_MINUTES))
+
+
+def empty_series():
+    """
+    Ряды одного дня по всем колонкам, заполненные NaN
+    """
+    return {column: array('d', [math.nan]) * SLOTS_PER_DAY for column in WEATHER_COLUMNS}
+
+
+class WeatherStorage(ABC):
+    """
+    Интерфейс хранения 15-минутных прогнозов, которым пользуются upd_data_to_db,
+    эндпоинты городов, снимок прогнозов и сжатие истории.
+
+    Строки прогноза передаются как (location_id, timestamp, temperature, surface_pressure,
+    wind_speed, precipitation), timestamp в формате 'YYYY-MM-DD HH:MM:SS'.
+    precision - до скольких знаков округлять прочитанные значения (None - не округлять)
+    """
+    name = None
+    precision = None
+
+    @abstractmethod
+    async def write(self, db, location_id, rows):
+        """
+        Записывает строки прогноза локации и возвращает (записано слотов, пропущено слотов без изменений)
+        """
+        ...
+
+    @abstractmethod
+    async def read_range(self, db, location_id, start, end, columns):
+        """
+        Список (timestamp, *значения columns) с start по end включительно, по возрастанию времени
+        """
+        ...
+
+    @abstractmethod
+    async def read_range_many(self, db, location_ids, start, end, columns):
+        """
+        То же, что read_range, но одним запросом для нескольких локаций:
+        {location_id: список (timestamp, *значения columns)}, локации без данных в словарь не попадают
+        """
+        ...
+
+    @abstractmethod
+    async def read_day(self, db, day, location_ids=None):
+        """
+        {location_id: {колонка: последовательность из SLOTS_PER_DAY значений, NaN - нет данных}}
+        за день day для всех локаций или только для location_ids
+        """
+        ...
+
+    @abstractmethod
+    async def compact(self, db, raw_cutoff):
+        """
+        Сворачивает данные до raw_cutoff в часовые агрегаты weather_hourly и удаляет их.
+        Возвращает (записано часовых строк, удалено записей)
+        """
+        ...
+
+    async def read_hourly_range(self, db, location_id, start, end, columns):
+        """
+        То же, что read_range, но по часовым агрегатам сжатых дней
+        """
+        query = f'''
+            SELECT timestamp, {", ".join(columns)}
+            FROM weather_hourly
+            WHERE location_id = ? AND timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp
+        '''
+        async with db.execute(query, (location_id, str(start), str(end))) as cursor:
+            return await cursor.fetchall()
+
+    async def read_hourly_range_many(self, db, location_ids, start, end, columns):
+        """
+        То же, что read_range_many, но по часовым агрегатам сжатых дней
+        """
+        query = f'''
+            SELECT location_id, timestamp, {", ".join(columns)}
+            FROM weather_hourly
+            WHERE location_id IN ({", ".join("?" * len(location_ids))}) AND timestamp >= ? AND timestamp <= ?
+            ORDER BY location_id, timestamp
+        '''
+        async with db.execute(query, (*location_ids, str(start), str(end))) as cursor:
+            return group_by_location(await cursor.fetchall())
+
+
+def group_by_location(rows):
+    """
+    Раскладывает строки (location_id, *запись) по локациям: {location_id: [запись, ...]}
+    """
+    result = {}
+    for location_id, *record in rows:
+        result.setdefault(location_id, []).append(tuple(record))
+    return result
+
+
+class RowStorage(WeatherStorage):
+    """
+    Таблица weather_data: одна строка на (локация, 15-минутный слот)
+    """
+    name = "rows"
+
+    async def write(self, db, location_id, rows):
+        """
+        Сравнивает прогноз с сохранёнными слотами и через UPSERT по ключу
+        (location_id, timestamp) пишет одним executemany только изменившиеся
+        """
+        query_stored = '''
+            SELECT timestamp, temperature, surface_pressure, wind_speed, precipitation
+            FROM weather_data
+            WHERE location_id = ? AND timestamp >= ? AND timestamp <= ?
+        '''
+        async with db.execute(query_stored, (location_id, rows[0][1], rows[-1][1])) as cursor:
+            stored = {record[0]: record[1:] for record in await cursor.fetchall()}
+        changed = [row for row in rows if stored.get(row[1]) != row[2:]]
+
+        await db.executemany('''
+            INSERT INTO weather_data (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(location_id, timestamp) DO UPDATE SET
+                temperature = excluded.temperature,
+                surface_pressure = excluded.surface_pressure,
+                wind_speed = excluded.wind_speed,
+                precipitation = excluded.precipitation
+        ''', changed)
+        return len(changed), len(rows) - len(changed)
+
+    async def read_range(self, db, location_id, start, end, columns):
+        query = f'''
+            SELECT timestamp, {", ".join(columns)}
+            FROM weather_data
+            WHERE location_id = ? AND timestamp >= ? AND timestamp <= ?
+            ORDER BY timestamp
+        '''
+        async with db.execute(query, (location_id, str(start), str(end))) as cursor:
+            return await cursor.fetchall()
+
+    async def read_range_many(self, db, location_ids, start, end, columns):
+        query = f'''
+            SELECT location_id, timestamp, {", ".join(columns)}
+            FROM weather_data
+            WHERE location_id IN ({", ".join("?" * len(location_ids))}) AND timestamp >= ? AND timestamp <= ?
+            ORDER BY location_id, timestamp
+        '''
+        async with db.execute(query, (*location_ids, str(start), str(end))) as cursor:
+            return group_by_location(await cursor.fetchall())
+
+    async def read_day(self, db, day, location_ids=None):
+        query = f'''
+            SELECT w.location_id, w.timestamp, {", ".join("w." + column for column in WEATHER_COLUMNS)}
+            FROM locations l
+            JOIN weather_data w ON w.location_id = l.id AND w.timestamp >= ? AND w.timestamp < ?
+        '''
+        params = [f"{day} 00:00:00", f"{day + timedelta(days=1)} 00:00:00"]
+        if location_ids is not None:
+            query += f"WHERE l.id IN ({', '.join('?' * len(location_ids))})"
+            params.extend(location_ids)
+        async with db.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+
+        series = {}
+        for location_id, timestamp, *values in rows:
+            slot = time_to_slot(timestamp[11:19])
+            if slot is None:
+                continue
+            location_series = series.get(location_id)
+            if location_series is None:
+                location_series = series[location_id] = empty_series()
+            for column, value in zip(WEATHER_COLUMNS, values):
+                location_series[column][slot] = math.nan if value is None else value
+        return series
+
+    async def compact(self, db, raw_cutoff):
+        cursor = await db.execute('''
+            INSERT INTO weather_hourly (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+            SELECT location_id, strftime('%Y-%m-%d %H:00:00', timestamp),
+                   AVG(temperature), AVG(surface_pressure), AVG(wind_speed), SUM(precipitation)
+            FROM weather_data
+            WHERE location_id IN (SELECT id FROM locations) AND timestamp < ?
+            GROUP BY location_id, strftime('%Y-%m-%d %H:00:00', timestamp)
+            ON CONFLICT(location_id, timestamp) DO UPDATE SET
+                temperature = excluded.temperature,
+                surface_pressure = excluded.surface_pressure,
+                wind_speed = excluded.wind_speed,
+                precipitation = excluded.precipitation
+        ''', (raw_cutoff,))
+        hourly_rows = cursor.rowcount
+
+        cursor = await db.execute('''DELETE FROM weather_data
+                                     WHERE location_id IN (SELECT id FROM locations) AND timestamp < ?''', (raw_cutoff,))
+        return hourly_rows, cursor.rowcount
+
+
+def pack_column(values):
+    """
+    Упаковывает ряд значений в BLOB из float32 little-endian, None превращается в NaN
+    """
+    packed = array('f', (math.nan if value is None else value for value in values))
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def unpack_column(blob):
+    """
+    Ряд float32 из BLOB без копирования данных (memoryview поверх bytes)
+    """
+    if sys.byteorder == 'big':
+        unpacked = array('f')
+        unpacked.frombytes(blob)
+        unpacked.byteswap()
+        return unpacked
+    return memoryview(blob).cast('f')
+
+
+def _same_float32(stored, value):
+    """
+    Совпадает ли сохранённое значение float32 с новым значением после упаковки во float32
+    """
+    packed = array('f', [value])[0]
+    return stored == packed or (math.isnan(stored) and math.isnan(packed))
+
+
+class ColumnarStorage(WeatherStorage):
+    """
+    Таблица weather_columns: одна строка на (локация, день), в каждой колонке -
+    упакованный массив float32 из SLOTS_PER_DAY значений. Время слота задаётся
+    его индексом, поэтому timestamp и id строк не хранятся.
+    Значения отдаются округлёнными до 2 знаков, чтобы не показывать погрешность float32
+    """
+    name = "columnar"
+    precision = 2
+
+    async def _read_days(self, db, location_id, first_day, last_day):
+        query = f'''
+            SELECT day, {", ".join(WEATHER_COLUMNS)}
+            FROM weather_columns
+            WHERE location_id = ? AND day >= ? AND day <= ?
+            ORDER BY day
+        '''
+        async with db.execute(query, (location_id, str(first_day), str(last_day))) as cursor:
+            return await cursor.fetchall()
+
+    async def write(self, db, location_id, rows):
+        """
+        Раскладывает строки по дням и переписывает только дни, в которых
+        изменился хотя бы один слот. Слоты, которых нет в новом прогнозе,
+        сохраняют прежние значения
+        """
+        days = {}
+        for _, timestamp, *values in rows:
+            slot = time_to_slot(timestamp[11:19])
+            if slot is None:
+                continue
+            day_series = days.setdefault(timestamp[:10], [[None] * SLOTS_PER_DAY for _ in WEATHER_COLUMNS])
+            for column_values, value in zip(day_series, values):
+                column_values[slot] = math.nan if value is None else value
+
+        stored = {
+            day: [unpack_column(blob) for blob in blobs]
+            for day, *blobs in await self._read_days(db, location_id, min(days), max(days))
+        }
+
+        written = 0
+        updates = []
+        for day, day_series in days.items():
+            old_columns = stored.get(day)
+            changed_slots = set()
+            for index, column_values in enumerate(day_series):
+                for slot, value in enumerate(column_values):
+                    if value is None:
+                        if old_columns is not None:
+                            column_values[slot] = old_columns[index][slot]
+                    elif old_columns is None or not _same_float32(old_columns[index][slot], value):
+                        changed_slots.add(slot)
+            if changed_slots:
+                written += len(changed_slots)
+                updates.append((location_id, day, *(pack_column(column_values) for column_values in day_series)))
+
+        if updates:
+            await db.executemany(f'''
+                INSERT OR REPLACE INTO weather_columns (location_id, day, {", ".join(WEATHER_COLUMNS)})
+                VALUES (?, ?, {", ".join("?" * len(WEATHER_COLUMNS))})
+            ''', updates)
+        return written, len(rows) - written
+
+    def _day_records(self, day, blobs, indexes, start_text, end_text):
+        """
+        Записи (timestamp, *значения) одного дня в пределах start_text..end_text, слоты без данных пропускаются
+        """
+        day_columns = [unpack_column(blob) for blob in blobs]
+        day_date = datetime.strptime(day, "%Y-%m-%d").date()
+        records = []
+        for slot in range(SLOTS_PER_DAY):
+            timestamp = slot_timestamp(day_date, slot)
+            if timestamp < start_text or timestamp > end_text:
+                continue
+            values = [day_columns[index][slot] for index in indexes]
+            if any(math.isnan(value) for value in values):
+                continue
+            records.append((timestamp, *(round(value, self.precision) for value in values)))
+        return records
+
+    async def read_range(self, db, location_id, start, end, columns):
+        indexes = [WEATHER_COLUMNS.index(column) for column in columns]
+        records = []
+        for day, *blobs in await self._read_days(db, location_id, start.date(), end.date()):
+            records.extend(self._day_records(day, blobs, indexes, str(start), str(end)))
+        return records
+
+    async def read_range_many(self, db, location_ids, start, end, columns):
+        indexes = [WEATHER_COLUMNS.index(column) for column in columns]
+        query = f'''
+            SELECT location_id, day, {", ".join(WEATHER_COLUMNS)}
+            FROM weather_columns
+            WHERE location_id IN ({", ".join("?" * len(location_ids))}) AND day >= ? AND day <= ?
+            ORDER BY location_id, day
+        '''
+        async with db.execute(query, (*location_ids, str(start.date()), str(end.date()))) as cursor:
+            rows = await cursor.fetchall()
+        result = {}
+        for location_id, day, *blobs in rows:
+            records = self._day_records(day, blobs, indexes, str(start), str(end))
+            if records:
+                result.setdefault(location_id, []).extend(records)
+        return result
+
+    async def read_day(self, db, day, location_ids=None):
+        query = f'''
+            SELECT location_id, {", ".join(WEATHER_COLUMNS)}
+            FROM weather_columns
+            WHERE day = ?
+        '''
+        params = [str(day)]
+        if location_ids is not None:
+            query += f"AND location_id IN ({', '.join('?' * len(location_ids))})"
+            params.extend(location_ids)
+        async with db.execute(query, params) as cursor:
+            rows = await cursor.fetchall()
+        return {
+            location_id: {column: unpack_column(blob) for column, blob in zip(WEATHER_COLUMNS, blobs)}
+            for location_id, *blobs in rows
+        }
+
+    async def compact(self, db, raw_cutoff):
+        cutoff_day = raw_cutoff[:10]
+        query = f'''
+            SELECT location_id, day, {", ".join(WEATHER_COLUMNS)}
+            FROM weather_columns
+            WHERE location_id IN (SELECT id FROM locations) AND day < ?
+        '''
+        async with db.execute(query, (cutoff_day,)) as cursor:
+            days = await cursor.fetchall()
+
+        hourly = []
+        for location_id, day, *blobs in days:
+            day_columns = [unpack_column(blob) for blob in blobs]
+            day_date = datetime.strptime(day, "%Y-%m-%d").date()
+            for hour in range(24):
+                aggregates = []
+                for column, values in zip(WEATHER_COLUMNS, day_columns):
+                    present = [value for value in values[hour * SLOTS_PER_HOUR:(hour + 1) * SLOTS_PER_HOUR] if not math.isnan(value)]
+                    if not present:
+                        aggregates.append(None)
+                    elif column == "precipitation":
+                        aggregates.append(round(sum(present), self.precision))
+                    else:
+                        aggregates.append(round(sum(present) / len(present), self.precision))
+                if any(value is not None for value in aggregates):
+                    hourly.append((location_id, slot_timestamp(day_date, hour * SLOTS_PER_HOUR), *aggregates))
+
+        await db.executemany(UPSERT_HOURLY, hourly)
+        cursor = await db.execute('''DELETE FROM weather_columns
+                                     WHERE location_id IN (SELECT id FROM locations) AND day < ?''', (cutoff_day,))
+        return len(hourly), cursor.rowcount
+
+
+STORAGES = {storage.name: storage for storage in (RowStorage(), ColumnarStorage())}
+
+storage = STORAGES[WEATHER_STORAGE]
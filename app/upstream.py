@@ -0,0 +1,220 @@
+import time
+import random
+import asyncio
+
+import aiohttp
+
+from app import http_client
+from settings import (OPEN_METEO_URL, UPSTREAM_RATE, UPSTREAM_BURST, UPSTREAM_RETRIES,
+                      UPSTREAM_BACKOFF_BASE, UPSTREAM_BACKOFF_MAX,
+                      BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT)
+
+
+class UpstreamError(Exception):
+    """
+    Запрос к внешнему api не удался. transient - сбой временный (недоступность, 5xx, 429),
+    и вместо ошибки можно отдать устаревшие данные из кеша. retry_after - пауза из заголовка Retry-After
+    """
+    transient = True
+    retry_after = None
+
+
+class UpstreamStatusError(UpstreamError):
+    """
+    Внешнее api ответило статусом, отличным от 200
+    """
+
+    def __init__(self, status):
+        super().__init__(f"Error fetching weather data: {status}")
+        self.status = status
+        self.transient = status == 429 or status >= 500
+
+
+class UpstreamUnavailableError(UpstreamError):
+    """
+    Не удалось соединиться с внешним api или дождаться ответа
+    """
+
+
+class CircuitOpenError(UpstreamError):
+    """
+    Автомат разомкнут: запрос не отправлялся
+    """
+
+
+class TokenBucket:
+    """
+    Ограничитель частоты запросов: rate токенов в секунду, не больше burst подряд.
+
+    Токены выдаются в долг: acquire сразу резервирует токен и ждёт ровно столько,
+    сколько нужно до его появления, поэтому ожидающие обслуживаются по очереди без блокировок
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+
+    def reserve(self):
+        """
+        Резервирует токен и возвращает, сколько секунд ждать до его появления
+        """
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+        self.tokens -= 1
+        return 0.0 if self.tokens >= 0 else -self.tokens / self.rate
+
+    async def acquire(self):
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class CircuitBreaker:
+    """
+    Автомат: после failure_threshold неудач подряд размыкается и reset_timeout секунд
+    сразу отклоняет запросы. Затем пропускает один пробный запрос (half_open):
+    успех замыкает автомат, неудача снова размыкает
+    """
+
+    def __init__(self, failure_threshold, reset_timeout):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self._trial = False
+
+    @property
+    def state(self):
+        if self.opened_at is None:
+            return "closed"
+        if time.monotonic() - self.opened_at < self.reset_timeout:
+            return "open"
+        return "half_open"
+
+    def allow(self):
+        """
+        Можно ли отправить запрос: (разрешён, взял ли этот вызов пробный запрос).
+        Взявший пробный запрос передаёт trial=True в record_failure и затем освобождает его через finish_trial
+        """
+        state = self.state
+        if state == "closed":
+            return True, False
+        if state == "half_open" and not self._trial:
+            self._trial = True
+            return True, True
+        return False, False
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+
+    def record_failure(self, trial=False):
+        self.failures += 1
+        if trial or self.failures >= self.failure_threshold:
+            self.opened_at = time.monotonic()
+
+    def finish_trial(self):
+        """
+        Освобождает пробный запрос. Вызывается только тем, кому allow его выдал, после завершения
+        запроса любым образом (в том числе отменой), чтобы автомат мог пропустить следующий
+        """
+        self._trial = False
+
+
+class UpstreamClient:
+    """
+    GET-запросы к внешнему api через общую сессию http_client с ограничением частоты,
+    повторами и автоматом.
+
+    Временные сбои (нет соединения, таймаут, 5xx, 429) повторяются до retries раз
+    с экспоненциальной задержкой и случайным разбросом (full jitter), для 429 учитывается Retry-After.
+    Ответы 4xx не повторяются. Пока автомат разомкнут, запросы сразу завершаются CircuitOpenError
+    """
+
+    def __init__(self, url, bucket, breaker, retries, backoff_base, backoff_max):
+        self.url = url
+        self.bucket = bucket
+        self.breaker = breaker
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.requests = 0
+        self.retried = 0
+        self.failures = 0
+        self.rejected = 0
+
+    def backoff(self, attempt, retry_after=None):
+        """
+        Задержка перед повтором номер attempt (с нуля)
+        """
+        delay = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+        if retry_after is not None:
+            delay = max(delay, min(self.backoff_max, retry_after))
+        return delay
+
+    async def _attempt(self, params):
+        await self.bucket.acquire()
+        self.requests += 1
+        try:
+            async with http_client.session() as session:
+                async with session.get(self.url, params=params) as resp:
+                    if resp.status == 200:
+                        return await resp.read(), None
+                    error = UpstreamStatusError(resp.status)
+                    retry_after = resp.headers.get("Retry-After", "")
+                    if retry_after.isdigit():
+                        error.retry_after = float(retry_after)
+                    return None, error
+        except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+            return None, UpstreamUnavailableError(f"Request failed: {str(e) or type(e).__name__}")
+
+    async def get(self, params):
+        """
+        Возвращает тело ответа в байтах или выбрасывает UpstreamError
+        """
+        for attempt in range(self.retries + 1):
+            allowed, trial = self.breaker.allow()
+            if not allowed:
+                self.rejected += 1
+                raise CircuitOpenError("Weather service circuit is open")
+
+            try:
+                body, error = await self._attempt(params)
+                if error is None or not error.transient:
+                    self.breaker.record_success()
+                    if error is None:
+                        return body
+                    raise error
+
+                self.failures += 1
+                self.breaker.record_failure(trial)
+            finally:
+                if trial:
+                    self.breaker.finish_trial()
+            if attempt < self.retries:
+                self.retried += 1
+                await asyncio.sleep(self.backoff(attempt, error.retry_after))
+        raise error
+
+    def stats(self):
+        """
+        Счётчики запросов и состояние автомата
+        """
+        return {
+            "requests": self.requests,
+            "retried": self.retried,
+            "failures": self.failures,
+            "rejected": self.rejected,
+            "breaker": self.breaker.state,
+        }
+
+
+open_meteo = UpstreamClient(
+    OPEN_METEO_URL,
+    TokenBucket(UPSTREAM_RATE, UPSTREAM_BURST),
+    CircuitBreaker(BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_TIMEOUT),
+    UPSTREAM_RETRIES, UPSTREAM_BACKOFF_BASE, UPSTREAM_BACKOFF_MAX,
+)
@@ -0,0 +1,113 @@
+"""
+Замер разбора ответа api.open-meteo.com с прогнозом minutely_15 для пачки локаций.
+
+Сравнивает прежний путь (resp.text(), json.loads и обращения к ключам словаря)
+с текущим parse_forecasts (validate_json по байтам ответа), а при установленном
+orjson - ещё и orjson.loads для сравнения.
+
+По умолчанию ответ собирается в формате api (с метаданными и *_units) для
+REFRESH_BATCH_SIZE локаций на FORECAST_DAYS дней. Можно передать файл с записанным
+ответом api, например сохранённым через curl.
+
+Запуск из корня проекта:
+python benchmarks/decode_bench.py [файл с ответом api]
+"""
+import os
+import sys
+import json
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.service import build_weather_rows, parse_forecasts
+from ingest_bench import make_payload
+from settings import REFRESH_BATCH_SIZE, FORECAST_DAYS
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def make_response(locations, days):
+    """
+    Ответ api для locations локаций на days дней в байтах
+    """
+    forecasts = []
+    for location in range(locations):
+        minutely_15 = {}
+        for offset in range(days):
+            for key, values in make_payload(date.today() + timedelta(days=offset))['minutely_15'].items():
+                minutely_15.setdefault(key, []).extend(values)
+        forecasts.append({
+            "latitude": 50.0 + location / 100,
+            "longitude": 30.0 + location / 100,
+            "generationtime_ms": 0.5,
+            "utc_offset_seconds": 0,
+            "timezone": "GMT",
+            "timezone_abbreviation": "GMT",
+            "elevation": 150.0,
+            "minutely_15_units": {
+                "time": "iso8601",
+                "temperature_2m": "°C",
+                "surface_pressure": "hPa",
+                "wind_speed_10m": "km/h",
+                "precipitation": "mm",
+            },
+            "minutely_15": minutely_15,
+        })
+    return json.dumps(forecasts if locations > 1 else forecasts[0]).encode()
+
+
+def decode_stdlib(body):
+    forecasts = json.loads(body.decode())
+    if isinstance(forecasts, dict):
+        forecasts = [forecasts]
+    for forecast in forecasts:
+        minutely_15 = forecast['minutely_15']
+        for key in ('time', 'temperature_2m', 'surface_pressure', 'wind_speed_10m', 'precipitation'):
+            minutely_15[key]
+    return forecasts
+
+
+def decode_orjson(body):
+    forecasts = orjson.loads(body)
+    return forecasts if isinstance(forecasts, list) else [forecasts]
+
+
+def run(decode, body, repeat):
+    """
+    Разбирает body repeat раз и возвращает время в мс: только разбора и разбора вместе с построением строк weather_data
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        decode(body)
+    decoded = time.perf_counter()
+    for _ in range(repeat):
+        for location_id, forecast in enumerate(decode(body)):
+            build_weather_rows(location_id, forecast)
+    finished = time.perf_counter()
+    return (decoded - started) / repeat * 1000, (finished - decoded) / repeat * 1000
+
+
+def main():
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], 'rb') as f:
+            body = f.read()
+    else:
+        body = make_response(REFRESH_BATCH_SIZE, FORECAST_DAYS)
+    repeat = 50
+
+    print(f"ответ: {len(body) / 1024:,.0f} КБ")
+    decoders = [("json.loads", decode_stdlib)]
+    if orjson is not None:
+        decoders.append(("orjson.loads (без проверки структуры)", decode_orjson))
+    decoders.append(("parse_forecasts", parse_forecasts))
+    for name, decode in decoders:
+        decode_ms, total_ms = run(decode, body, repeat)
+        print(f"{name}: разбор {decode_ms:.1f} мс, вместе со строками {total_ms:.1f} мс")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Замер скорости записи прогнозов minutely_15 в weather_data (строк в секунду).
+
+Сравнивает построчную вставку (по одному await db.execute на точку, как было раньше)
+с текущей write_location_weather: первую запись прогноза и повторную запись того же
+прогноза, когда все слоты пропускаются без изменений.
+
+Запуск из корня проекта:
+python benchmarks/ingest_bench.py [кол-во локаций]
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from datetime import date, datetime, timedelta
+
+import aiosqlite
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.db import init_db
+from app.service import write_location_weather
+
+
+def make_payload(day):
+    start = datetime.combine(day, datetime.min.time())
+    return {
+        "minutely_15": {
+            "time": [(start + timedelta(minutes=15 * slot)).strftime("%Y-%m-%dT%H:%M") for slot in range(96)],
+            "temperature_2m": [20.0 + slot / 10 for slot in range(96)],
+            "surface_pressure": [1000.0] * 96,
+            "wind_speed_10m": [5.0] * 96,
+            "precipitation": [0.0] * 96,
+        }
+    }
+
+
+async def write_row_by_row(db, location_id, weather_data):
+    minutely_15 = weather_data['minutely_15']
+    await db.execute('DELETE FROM weather_data WHERE location_id = ? AND DATE(timestamp) = ?', (location_id, datetime.today().date()))
+    for row in zip(minutely_15['time'], minutely_15['temperature_2m'], minutely_15['surface_pressure'],
+                   minutely_15['wind_speed_10m'], minutely_15['precipitation']):
+        await db.execute('''
+            INSERT INTO weather_data (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+            VALUES (?, ?, ?, ?, ?, ?)
+        ''', (location_id, str(datetime.fromisoformat(row[0])), *row[1:]))
+    return 96
+
+
+async def write_bulk(db, location_id, weather_data):
+    written, skipped = await write_location_weather(db, location_id, weather_data)
+    return written + skipped
+
+
+async def run(writer, locations, passes=1):
+    """
+    Пишет прогноз для locations локаций passes раз и возвращает скорость последнего прохода
+    """
+    payload = make_payload(date.today())
+    with tempfile.TemporaryDirectory() as tmp:
+        db_route = os.path.join(tmp, "bench.db")
+        await init_db(db_route)
+        async with aiosqlite.connect(db_route) as db:
+            await db.executemany("INSERT INTO locations (id, latitude, longitude) VALUES (?, ?, ?)",
+                                 [(location_id, location_id, location_id) for location_id in range(1, locations + 1)])
+            for _ in range(passes):
+                started = time.perf_counter()
+                rows = 0
+                for location_id in range(1, locations + 1):
+                    rows += await writer(db, location_id, payload)
+                await db.commit()
+                elapsed = time.perf_counter() - started
+    return rows / elapsed
+
+
+async def main():
+    locations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    print(f"построчно: {await run(write_row_by_row, locations):,.0f} строк/с")
+    print(f"write_location_weather: {await run(write_bulk, locations):,.0f} строк/с")
+    print(f"write_location_weather, повторно без изменений: {await run(write_bulk, locations, passes=2):,.0f} строк/с")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,116 @@
+"""
+Замер задержки цикла событий во время обновления погоды.
+
+Пока идёт upd_locations_to_db, параллельная задача каждую миллисекунду засыпает
+и замеряет, насколько позже она проснулась. Сравниваются разбор и запись в основном
+процессе (INGEST_MODE=inline) и в отдельном процессе (INGEST_MODE=process, app/ingest.py).
+Запросы к api подменяются готовыми ответами, а пересборка снимка после записи отключается,
+поэтому замеряются только разбор и запись.
+
+Запуск из корня проекта:
+python benchmarks/loop_lag_bench.py [кол-во локаций]
+"""
+import os
+import sys
+import json
+import time
+import asyncio
+import tempfile
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+import app.service as service
+from app.db import init_db, database
+from app.ingest import IngestProcess
+
+
+def make_payload(day, temperature):
+    start = datetime.combine(day, datetime.min.time())
+    return {
+        "minutely_15": {
+            "time": [(start + timedelta(minutes=15 * slot)).strftime("%Y-%m-%dT%H:%M") for slot in range(96)],
+            "temperature_2m": [temperature + slot / 10 for slot in range(96)],
+            "surface_pressure": [1000.0] * 96,
+            "wind_speed_10m": [5.0] * 96,
+            "precipitation": [0.0] * 96,
+        }
+    }
+
+
+bodies = {}
+
+
+async def fake_get_weather(params):
+    return bodies[params['latitude']]
+
+
+def prepare_bodies(locations):
+    """
+    Заранее собирает ответы api для пачек, чтобы замерялись только разбор и запись
+    """
+    latitudes = [str(location_id / 1000) for location_id in range(1, locations + 1)]
+    for start in range(0, locations, service.REFRESH_BATCH_SIZE):
+        batch = latitudes[start:start + service.REFRESH_BATCH_SIZE]
+        bodies[','.join(batch)] = json.dumps([make_payload(date.today(), float(latitude)) for latitude in batch]).encode()
+
+
+async def skip_snapshot(location_ids=None):
+    return None
+
+
+async def measure_lag(stop, lags):
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(0.001)
+        lags.append(time.perf_counter() - started - 0.001)
+
+
+async def run(locations, ingest):
+    """
+    Обновляет прогнозы locations локаций и возвращает (время обновления, p99 и максимум задержки цикла, мс)
+    """
+    with tempfile.TemporaryDirectory() as tmp:
+        database.db_route = os.path.join(tmp, "bench.db")
+        await init_db(database.db_route)
+        async with database.writer() as db:
+            await db.executemany("INSERT INTO locations (id, latitude, longitude) VALUES (?, ?, ?)",
+                                 [(location_id, location_id / 1000, location_id / 1000)
+                                  for location_id in range(1, locations + 1)])
+            await db.commit()
+
+        service.ingest = ingest or IngestProcess(database.db_route)
+        if ingest is not None:
+            ingest.db_route = database.db_route
+            await ingest.start()
+        await database.open()
+        stop = asyncio.Event()
+        lags = []
+        lag_task = asyncio.create_task(measure_lag(stop, lags))
+        try:
+            started = time.perf_counter()
+            await service.upd_locations_to_db(list(range(1, locations + 1)))
+            elapsed = time.perf_counter() - started
+        finally:
+            stop.set()
+            await lag_task
+            await database.close()
+            if ingest is not None:
+                await ingest.close()
+
+    lags.sort()
+    return elapsed, lags[int(len(lags) * 0.99)] * 1000, lags[-1] * 1000
+
+
+async def main():
+    locations = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+    service.get_weather = fake_get_weather
+    service.refresh_snapshot = skip_snapshot
+    prepare_bodies(locations)
+    for name, ingest in (("в основном процессе", None), ("в процессе записи", IngestProcess(None))):
+        elapsed, p99, worst = await run(locations, ingest)
+        print(f"{name}: обновление {elapsed:.2f} с, задержка цикла p99 {p99:.1f} мс, максимум {worst:.1f} мс")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
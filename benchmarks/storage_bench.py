@@ -0,0 +1,62 @@
+"""
+Сравнение хранилищ прогнозов (app/storage.py): размер файла БД, скорость записи
+и чтения дня по всем локациям.
+
+Запуск из корня проекта:
+python benchmarks/storage_bench.py [кол-во локаций] [кол-во дней]
+"""
+import os
+import sys
+import time
+import asyncio
+import tempfile
+from datetime import date, timedelta
+
+import aiosqlite
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+from app.db import init_db
+from app.service import build_weather_rows
+from app.storage import STORAGES
+from ingest_bench import make_payload
+
+
+async def run(storage, locations, days):
+    first_day = date.today()
+    payloads = [make_payload(first_day + timedelta(days=offset)) for offset in range(days)]
+    with tempfile.TemporaryDirectory() as tmp:
+        db_route = os.path.join(tmp, "bench.db")
+        await init_db(db_route)
+        async with aiosqlite.connect(db_route) as db:
+            await db.executemany("INSERT INTO locations (id, latitude, longitude) VALUES (?, ?, ?)",
+                                 [(location_id, location_id, location_id) for location_id in range(1, locations + 1)])
+            started = time.perf_counter()
+            for location_id in range(1, locations + 1):
+                for payload in payloads:
+                    await storage.write(db, location_id, build_weather_rows(location_id, payload))
+            await db.commit()
+            write_time = time.perf_counter() - started
+
+            started = time.perf_counter()
+            await storage.read_day(db, first_day)
+            read_time = time.perf_counter() - started
+
+        async with aiosqlite.connect(db_route) as db:
+            await db.execute("VACUUM")
+        size = os.path.getsize(db_route)
+
+    rows = locations * days * 96
+    print(f"{storage.name}: {size / 1024:,.0f} КБ, запись {rows / write_time:,.0f} строк/с, "
+          f"чтение дня {locations / read_time:,.0f} локаций/с")
+
+
+async def main():
+    locations = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    days = int(sys.argv[2]) if len(sys.argv) > 2 else 3
+    for storage in STORAGES.values():
+        await run(storage, locations, days)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
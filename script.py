@@ -6,10 +6,19 @@ from apscheduler.schedulers.asyncio import AsyncIOScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from contextlib import asynccontextmanager
 
+from app import http_client
+from app.backfill import backfill
 from app.routes import users, cities, weather
-from app.db import init_db
-from app.service import upd_data_to_db
-from settings import DB_ROUTE, REFRESH_TIME
+from app.conditional import ConditionalGetMiddleware
+from app.db import init_db, database
+from app.ingest import ingest
+from app.leader import leader, leader_only
+from app.responses import JSONResponse
+from app.snapshot import refresh_snapshot, sync_generation
+from app.retention import compact_weather_data
+from app.service import refresh_due_locations
+from settings import (DB_ROUTE, REFRESH_TIME, REFRESH_SHARDS, COMPACTION_TIME,
+                      LEADER_LEASE_TTL, GENERATION_POLL_INTERVAL, INGEST_MODE)
 
 if sys.platform.startswith("win"):
     asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
@@ -20,13 +29,54 @@ scheduler = AsyncIOScheduler()
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """
-    Вызывает upd_data_to_db раз в 15 минут (если REFRESH_TIME=15)
+    Создаёт или обновляет структуру БД (init_db), открывает пул соединений с БД, общую http-сессию
+    и очередь загрузки прогнозов новых городов и вызывает
+    refresh_due_locations REFRESH_SHARDS раз за REFRESH_TIME минут (каждый раз обновляется очередной шард локаций),
+    а compact_weather_data раз в COMPACTION_TIME минут.
+
+    При запуске с несколькими процессами (uvicorn --workers N) обновление и сжатие выполняет только
+    ведущий процесс (app/leader.py), остальные раз в GENERATION_POLL_INTERVAL секунд сверяют поколение
+    данных в БД и подхватывают новые данные в свой снимок.
+
+    При INGEST_MODE=process ответы api разбираются и записываются в отдельном процессе (app/ingest.py)
     """
     try:
+        await init_db(DB_ROUTE)
+        await database.open()
+        await http_client.start()
+        await backfill.start()
+        if INGEST_MODE == "process":
+            await ingest.start()
+        await leader.acquire()
+        await refresh_snapshot()
+        scheduler.add_job(
+            leader.acquire,
+            trigger=IntervalTrigger(seconds=LEADER_LEASE_TTL / 3),
+            id='leader_lease_job',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+        scheduler.add_job(
+            sync_generation,
+            trigger=IntervalTrigger(seconds=GENERATION_POLL_INTERVAL),
+            id='generation_sync_job',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
         scheduler.add_job(
-            upd_data_to_db,
-            trigger=IntervalTrigger(minutes=REFRESH_TIME),
+            leader_only(refresh_due_locations),
+            trigger=IntervalTrigger(seconds=REFRESH_TIME * 60 / REFRESH_SHARDS),
             id='weather_update_job',
+            replace_existing=True,
+            max_instances=1,
+            coalesce=True
+        )
+        scheduler.add_job(
+            leader_only(compact_weather_data),
+            trigger=IntervalTrigger(minutes=COMPACTION_TIME),
+            id='weather_compaction_job',
             replace_existing=True
         )
         scheduler.start()
@@ -35,10 +85,25 @@ async def lifespan(app: FastAPI):
     except Exception as e:
         print(f"Ошибка инициализации планировщика: {e}")
     finally:
-        scheduler.shutdown()
+        if scheduler.running:
+            scheduler.shutdown()
+        await leader.release()
+        await backfill.close()
+        await ingest.close()
+        await http_client.close()
+        await database.close()
+
+
+def next_refresh_time():
+    """
+    Время следующего запуска обновления погоды или None, если планировщик не запущен
+    """
+    job = scheduler.get_job('weather_update_job')
+    return job.next_run_time if job is not None else None
 
 
-app = FastAPI(lifespan=lifespan)
+app = FastAPI(lifespan=lifespan, default_response_class=JSONResponse)
+app.add_middleware(ConditionalGetMiddleware, prefix="/cities/", next_run=next_refresh_time)
 
 app.include_router(users.router, prefix="/users")
 app.include_router(cities.router, prefix="/cities")
@@ -47,5 +112,4 @@ app.include_router(weather.router, prefix="/weather")
 
 if __name__ == "__main__":
     import uvicorn
-    asyncio.run(init_db(DB_ROUTE))
     uvicorn.run("script:app", host="127.0.0.1", port=8000, reload=True)
\ No newline at end of file
@@ -2,3 +2,37 @@ import os
 
 DB_ROUTE = os.getenv("DB_ROUTE", "weather.db")
 REFRESH_TIME = int(os.getenv("REFRESH_TIME", 15))
+REFRESH_SHARDS = int(os.getenv("REFRESH_SHARDS", 15))
+LEADER_LEASE_TTL = float(os.getenv("LEADER_LEASE_TTL", 30))
+GENERATION_POLL_INTERVAL = float(os.getenv("GENERATION_POLL_INTERVAL", 5))
+LOCATION_PRECISION = int(os.getenv("LOCATION_PRECISION", 2))
+REFRESH_CONCURRENCY = int(os.getenv("REFRESH_CONCURRENCY", 10))
+REFRESH_BATCH_SIZE = int(os.getenv("REFRESH_BATCH_SIZE", 50))
+INGEST_MODE = os.getenv("INGEST_MODE", "inline")
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 20))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", 10))
+OPEN_METEO_URL = os.getenv("OPEN_METEO_URL", "https://api.open-meteo.com/v1/forecast")
+UPSTREAM_RATE = float(os.getenv("UPSTREAM_RATE", 10))
+UPSTREAM_BURST = int(os.getenv("UPSTREAM_BURST", 10))
+UPSTREAM_RETRIES = int(os.getenv("UPSTREAM_RETRIES", 2))
+UPSTREAM_BACKOFF_BASE = float(os.getenv("UPSTREAM_BACKOFF_BASE", 0.5))
+UPSTREAM_BACKOFF_MAX = float(os.getenv("UPSTREAM_BACKOFF_MAX", 5))
+BREAKER_FAILURE_THRESHOLD = int(os.getenv("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_TIMEOUT = float(os.getenv("BREAKER_RESET_TIMEOUT", 30))
+DB_POOL_READERS = int(os.getenv("DB_POOL_READERS", 4))
+DB_MMAP_SIZE = int(os.getenv("DB_MMAP_SIZE", 256 * 1024 * 1024))
+DB_CACHE_SIZE = int(os.getenv("DB_CACHE_SIZE", 16 * 1024))
+DB_BUSY_TIMEOUT = int(os.getenv("DB_BUSY_TIMEOUT", 5000))
+SSE_BUFFER_SIZE = int(os.getenv("SSE_BUFFER_SIZE", 16))
+SSE_KEEPALIVE = float(os.getenv("SSE_KEEPALIVE", 15))
+CURRENT_CACHE_TTL = float(os.getenv("CURRENT_CACHE_TTL", 300))
+CURRENT_CACHE_MAXSIZE = int(os.getenv("CURRENT_CACHE_MAXSIZE", 10000))
+CURRENT_CACHE_PRECISION = int(os.getenv("CURRENT_CACHE_PRECISION", 2))
+FORECAST_DAYS = int(os.getenv("FORECAST_DAYS", 3))
+RAW_RETENTION_DAYS = int(os.getenv("RAW_RETENTION_DAYS", 7))
+HOURLY_RETENTION_DAYS = int(os.getenv("HOURLY_RETENTION_DAYS", 365))
+COMPACTION_TIME = int(os.getenv("COMPACTION_TIME", 360))
+WEATHER_STORAGE = os.getenv("WEATHER_STORAGE", "rows")
@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+import app.service as service
+from app.backfill import BackfillQueue, DONE, FAILED, QUEUED
+
+
+@pytest.mark.asyncio
+async def test_backfill_deduplicates_burst(monkeypatch):
+    calls = []
+    release = asyncio.Event()
+
+    async def fake_upd_locations_to_db(location_ids):
+        calls.append(list(location_ids))
+        await release.wait()
+        return {location_id for location_id in location_ids if location_id != 3}
+
+    monkeypatch.setattr(service, "upd_locations_to_db", fake_upd_locations_to_db)
+    queue = BackfillQueue()
+    await queue.start()
+    try:
+        for _ in range(5):
+            await queue.enqueue([1, 2, 3])
+        await queue.enqueue([2])
+        assert queue.status(1) == QUEUED
+
+        await asyncio.sleep(0)
+        await queue.enqueue([1, 4])
+        release.set()
+        for _ in range(10):
+            await asyncio.sleep(0)
+    finally:
+        await queue.close()
+
+    assert calls == [[1, 2, 3], [4]]
+    assert [queue.status(location_id) for location_id in (1, 2, 3, 4)] == [DONE, DONE, FAILED, DONE]
+
+
+@pytest.mark.asyncio
+async def test_backfill_runs_inline_when_not_started(monkeypatch):
+    calls = []
+
+    async def fake_upd_locations_to_db(location_ids):
+        calls.append(list(location_ids))
+        return set(location_ids)
+
+    monkeypatch.setattr(service, "upd_locations_to_db", fake_upd_locations_to_db)
+    queue = BackfillQueue()
+    await queue.enqueue([7, 7])
+
+    assert calls == [[7]]
+    assert queue.status(7) == DONE
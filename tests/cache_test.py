@@ -0,0 +1,53 @@
+import asyncio
+
+import pytest
+
+from app.cache import TTLCache
+
+
+@pytest.mark.asyncio
+async def test_concurrent_misses_share_one_load():
+    cache = TTLCache(maxsize=10, ttl=60)
+    calls = []
+
+    async def loader():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return {"temperature": 1.0}
+
+    results = await asyncio.gather(*(cache.get_or_load("key", loader) for _ in range(5)))
+
+    assert len(calls) == 1
+    assert all(result == {"temperature": 1.0} for result in results)
+    assert await cache.get_or_load("key", loader) == {"temperature": 1.0}
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["coalesced"] == 4
+    assert cache.stats()["hits"] == 1
+
+
+@pytest.mark.asyncio
+async def test_errors_are_not_cached():
+    cache = TTLCache(maxsize=10, ttl=60)
+
+    async def failing_loader():
+        raise RuntimeError("upstream down")
+
+    with pytest.raises(RuntimeError):
+        await cache.get_or_load("key", failing_loader)
+    assert cache.get("key") is None
+
+
+def test_expired_and_evicted_entries(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr("app.cache.time.monotonic", lambda: now[0])
+    cache = TTLCache(maxsize=2, ttl=10)
+
+    cache.set("a", 1)
+    cache.set("b", 2)
+    cache.get("a")
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+
+    now[0] += 11
+    assert cache.get("a") is None
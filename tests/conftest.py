@@ -21,9 +21,34 @@ async def reset_test_db():
         await db.execute("DROP TABLE IF EXISTS users")
         await db.execute("DROP TABLE IF EXISTS cities")
         await db.execute("DROP TABLE IF EXISTS weather_data")
+        await db.execute("DROP TABLE IF EXISTS weather_hourly")
+        await db.execute("DROP TABLE IF EXISTS weather_columns")
+        await db.execute("DROP TABLE IF EXISTS locations")
         
         await db.commit()
 
     await init_db(DB_ROUTE)
 
     yield
+
+
+def make_forecast_payload(day=None, temperature=20.0):
+    """
+    Собирает ответ api.open-meteo.com с 96 точками minutely_15 за день day
+    """
+    from datetime import date, datetime, timedelta
+
+    day = day or date.today()
+    start = datetime.combine(day, datetime.min.time())
+    times = [(start + timedelta(minutes=15 * slot)).strftime("%Y-%m-%dT%H:%M") for slot in range(96)]
+    return {
+        "latitude": 0.0,
+        "longitude": 0.0,
+        "minutely_15": {
+            "time": times,
+            "temperature_2m": [temperature + slot / 10 for slot in range(96)],
+            "surface_pressure": [1000.0] * 96,
+            "wind_speed_10m": [5.0] * 96,
+            "precipitation": [0.0] * 96,
+        },
+    }
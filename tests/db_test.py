@@ -0,0 +1,163 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+import pytest
+import aiosqlite
+
+from app.db import Database, init_db, table_columns, get_or_create_location, get_or_create_locations
+from conftest import DB_ROUTE
+
+
+@pytest.mark.asyncio
+async def test_init_db_migrates_weather_data_to_locations(tmp_path):
+    db_route = str(tmp_path / "old.db")
+    async with aiosqlite.connect(db_route) as db:
+        await db.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)")
+        await db.execute('''CREATE TABLE cities (id INTEGER PRIMARY KEY AUTOINCREMENT, city_name TEXT NOT NULL,
+                            latitude REAL NOT NULL, longitude REAL NOT NULL, user_id INTEGER)''')
+        await db.execute('''CREATE TABLE weather_data (id INTEGER PRIMARY KEY AUTOINCREMENT, city_id INTEGER NOT NULL,
+                            timestamp DATETIME NOT NULL, temperature REAL, surface_pressure REAL,
+                            wind_speed REAL, precipitation REAL)''')
+        await db.execute("INSERT INTO cities (city_name, latitude, longitude, user_id) VALUES ('Moscow', 55.7558, 37.6173, NULL)")
+        await db.execute("INSERT INTO cities (city_name, latitude, longitude, user_id) VALUES ('Moscow', 55.7558, 37.6173, 1)")
+        for city_id in (1, 2):
+            await db.execute("INSERT INTO weather_data (city_id, timestamp, temperature) VALUES (?, '2025-01-01 10:00:00', 1.5)",
+                             (city_id,))
+        await db.commit()
+
+    await init_db(db_route)
+
+    async with aiosqlite.connect(db_route) as db:
+        assert 'location_id' in await table_columns(db, 'weather_data')
+        async with db.execute("SELECT DISTINCT location_id FROM cities") as cursor:
+            assert len(await cursor.fetchall()) == 1
+        async with db.execute("SELECT location_id, temperature FROM weather_data") as cursor:
+            assert await cursor.fetchall() == [(1, 1.5)]
+
+
+@pytest.mark.asyncio
+async def test_init_db_dedupes_and_indexes_weather_data(tmp_path):
+    db_route = str(tmp_path / "dupes.db")
+    await init_db(db_route)
+    async with aiosqlite.connect(db_route) as db:
+        await db.execute("DROP INDEX idx_weather_data_location_timestamp")
+        for temperature in (1.0, 2.0):
+            await db.execute("INSERT INTO weather_data (location_id, timestamp, temperature) VALUES (1, '2025-01-01 10:00:00', ?)",
+                             (temperature,))
+        await db.commit()
+
+    await init_db(db_route)
+
+    async with aiosqlite.connect(db_route) as db:
+        async with db.execute("SELECT temperature FROM weather_data") as cursor:
+            assert await cursor.fetchall() == [(2.0,)]
+        async with db.execute("EXPLAIN QUERY PLAN SELECT temperature FROM weather_data WHERE location_id = ? AND timestamp = ?",
+                              (1, '2025-01-01 10:00:00')) as cursor:
+            plan = " ".join(row[-1] for row in await cursor.fetchall())
+        assert "idx_weather_data_location_timestamp" in plan
+
+
+@pytest.mark.asyncio
+async def test_database_pool_uses_wal_and_shares_writer(tmp_path):
+    db_route = str(tmp_path / "pool.db")
+    await init_db(db_route)
+    database = Database(db_route, readers=2)
+    await database.open()
+    try:
+        async with database.reader() as first, database.reader() as second:
+            assert first is not second
+            async with first.execute("PRAGMA journal_mode") as cursor:
+                assert (await cursor.fetchone())[0] == "wal"
+
+        async with database.writer() as writer:
+            await writer.execute("INSERT INTO users (name) VALUES ('pooled')")
+            await writer.commit()
+        async with database.writer() as same_writer:
+            assert same_writer is writer
+
+        async with database.reader() as db:
+            async with db.execute("SELECT COUNT(*) FROM users WHERE name = 'pooled'") as cursor:
+                assert (await cursor.fetchone())[0] == 1
+    finally:
+        await database.close()
+
+
+@pytest.mark.asyncio
+async def test_get_or_create_locations_matches_single_lookup():
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        existing = await get_or_create_location(db, 1.234, 5.678)
+        ids = await get_or_create_locations(db, [(9.871, 6.543), (1.2341, 5.6779), (9.8712, 6.5431), (-3.3, 4.4)])
+        await db.commit()
+
+        assert ids[1] == existing
+        assert ids[0] == ids[2] != existing
+        assert ids[3] == await get_or_create_location(db, -3.3, 4.4)
+
+
+async def create_baseline_db(db_route):
+    """
+    База в исходном формате проекта: погода хранится по city_id, новых таблиц нет
+    """
+    async with aiosqlite.connect(db_route) as db:
+        await db.execute("CREATE TABLE users (id INTEGER PRIMARY KEY AUTOINCREMENT, name TEXT NOT NULL)")
+        await db.execute('''CREATE TABLE cities (id INTEGER PRIMARY KEY AUTOINCREMENT, city_name TEXT NOT NULL,
+                            latitude REAL NOT NULL, longitude REAL NOT NULL, user_id INTEGER)''')
+        await db.execute('''CREATE TABLE weather_data (id INTEGER PRIMARY KEY AUTOINCREMENT, city_id INTEGER NOT NULL,
+                            timestamp DATETIME NOT NULL, temperature REAL, surface_pressure REAL,
+                            wind_speed REAL, precipitation REAL)''')
+        await db.execute("INSERT INTO cities (city_name, latitude, longitude) VALUES ('Moscow', 55.7558, 37.6173)")
+        await db.commit()
+
+
+def run_init_db(db_route):
+    """
+    Запускает процесс так же, как lifespan: init_db, затем открытие пула
+    """
+    async def start():
+        await init_db(db_route)
+        pool = Database(db_route)
+        await pool.open()
+        await pool.close()
+
+    asyncio.run(start())
+
+
+@pytest.mark.asyncio
+async def test_concurrent_init_db_migrates_baseline_schema(tmp_path):
+    db_route = str(tmp_path / "baseline.db")
+    await create_baseline_db(db_route)
+
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=4, mp_context=multiprocessing.get_context("spawn")) as executor:
+        await asyncio.gather(*(loop.run_in_executor(executor, run_init_db, db_route) for _ in range(4)))
+
+    async with aiosqlite.connect(db_route) as db:
+        async with db.execute("PRAGMA journal_mode") as cursor:
+            assert (await cursor.fetchone())[0] == 'wal'
+        assert 'data_generation' in await table_columns(db, 'locations')
+        assert await table_columns(db, 'leases')
+        async with db.execute("SELECT key FROM app_state") as cursor:
+            assert ('generation',) in await cursor.fetchall()
+        async with db.execute("SELECT COUNT(*) FROM locations") as cursor:
+            assert (await cursor.fetchone())[0] == 1
+
+
+def test_lifespan_migrates_baseline_schema(tmp_path, monkeypatch):
+    import script
+    from fastapi.testclient import TestClient
+    from app.db import database
+
+    db_route = str(tmp_path / "lifespan.db")
+    asyncio.run(create_baseline_db(db_route))
+    monkeypatch.setattr(script, "DB_ROUTE", db_route)
+    monkeypatch.setattr(database, "db_route", db_route)
+
+    with TestClient(script.app) as client:
+        assert client.get("/cities/cities").status_code == 200
+
+    async def check():
+        async with aiosqlite.connect(db_route) as db:
+            assert await table_columns(db, 'leases')
+            assert 'location_id' in await table_columns(db, 'weather_data')
+    asyncio.run(check())
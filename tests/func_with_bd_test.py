@@ -4,6 +4,8 @@ import pytest
 import aiosqlite
 from fastapi.testclient import TestClient
 
+from app import snapshot as forecast_snapshot
+from app.db import Database, database, get_database
 from conftest import DB_ROUTE
 from script import app
 
@@ -51,13 +53,16 @@ async def test_get_city_weather():
         timestamp_str = f"{current_date} 10:00:00"
 
         async with aiosqlite.connect(DB_ROUTE) as db:
+            async with db.execute("SELECT location_id FROM cities WHERE id = ?", (city_id,)) as cursor:
+                location_id = (await cursor.fetchone())[0]
+
             await db.execute(
                 """
                 INSERT INTO weather_data 
-                (city_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+                (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
                 VALUES (?, ?, ?, ?, ?, ?)
                 """,
-                (city_id, timestamp_str, 20.5, 5.0, 10.0, 20.9)
+                (location_id, timestamp_str, 20.5, 5.0, 10.0, 20.9)
             )
             await db.commit()
 
@@ -264,3 +269,265 @@ async def test_get_cities_for_user():
         print(f"Ошибка в тесте 'test_get_cities_for_user': {e}")
         raise
 
+
+@pytest.mark.asyncio
+async def test_get_city_weather_range():
+    try:
+        city_name = "Tver"
+        response = client.post("/cities/add_city",
+            json={
+                "city_name": city_name,
+                "latitude": 56.8587,
+                "longitude": 35.9176
+            },)
+        assert response.status_code == 201, f"Ожидался статус 201, но получен {response.status_code}"
+        city_id = response.json()["city"]["city_id"]
+
+        async with aiosqlite.connect(DB_ROUTE) as db:
+            async with db.execute("SELECT location_id FROM cities WHERE id = ?", (city_id,)) as cursor:
+                location_id = (await cursor.fetchone())[0]
+            await db.executemany(
+                """
+                INSERT INTO weather_data 
+                (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(location_id, f"2025-01-01 10:{minute:02d}:00", float(minute), 1000.0, 5.0, 0.0) for minute in (0, 15, 30, 45)]
+            )
+            await db.commit()
+
+        response = client.get(f"/cities/{city_name}?date=2025-01-01&from=10:00&to=10:45&step=30&weather_params=temperature")
+        assert response.status_code == 200, f"Ожидался статус 200, но получен {response.status_code}"
+        data = response.json()
+        assert data["timestamp"] == ["2025-01-01 10:00:00", "2025-01-01 10:30:00"]
+        assert data["temperature"] == [0.0, 30.0]
+        assert "wind_speed" not in data
+
+        response = client.get(f"/cities/{city_name}?date=2025-01-01&step=20")
+        assert response.status_code == 400, f"Ожидался статус 400, но получен {response.status_code}"
+    except Exception as e:
+        print(f"Ошибка в тесте 'test_get_city_weather_range': {e}")
+        raise
+
+@pytest.mark.asyncio
+async def test_get_city_weather_between_slots():
+    try:
+        city_name = "Tula"
+        response = client.post("/cities/add_city",
+            json={
+                "city_name": city_name,
+                "latitude": 54.1931,
+                "longitude": 37.6173
+            },)
+        assert response.status_code == 201, f"Ожидался статус 201, но получен {response.status_code}"
+        city_id = response.json()["city"]["city_id"]
+
+        async with aiosqlite.connect(DB_ROUTE) as db:
+            async with db.execute("SELECT location_id FROM cities WHERE id = ?", (city_id,)) as cursor:
+                location_id = (await cursor.fetchone())[0]
+            await db.executemany(
+                """
+                INSERT INTO weather_data 
+                (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(location_id, f"2025-01-01 10:{minute:02d}:00", float(minute), 1000.0, 5.0, 0.0) for minute in (0, 15)]
+            )
+            await db.commit()
+
+        response = client.get(f"/cities/{city_name}?date=2025-01-01&time=10:05:00&weather_params=temperature")
+        assert response.status_code == 200, f"Ожидался статус 200, но получен {response.status_code}"
+        assert response.json() == {"temperature": 5.0}
+
+        response = client.get(f"/cities/{city_name}?date=2025-01-01&time=10:05:00&method=nearest&weather_params=temperature")
+        assert response.status_code == 200, f"Ожидался статус 200, но получен {response.status_code}"
+        assert response.json() == {"temperature": 0.0}
+
+        response = client.get(f"/cities/{city_name}?date=2025-01-01&time=11:00:00&weather_params=temperature")
+        assert response.status_code == 404, f"Ожидался статус 404, но получен {response.status_code}"
+    except Exception as e:
+        print(f"Ошибка в тесте 'test_get_city_weather_between_slots': {e}")
+        raise
+
+
+@pytest.mark.asyncio
+async def test_city_listing_precomputed_until_add_city():
+    first = client.get("/cities/cities")
+    assert first.status_code == 200
+
+    app.dependency_overrides[get_database] = lambda: Database("/nonexistent/dir/weather.db")
+    try:
+        cached = client.get("/cities/cities")
+    finally:
+        app.dependency_overrides.clear()
+    assert cached.status_code == 200
+    assert cached.content == first.content
+    assert cached.headers["content-type"] == "application/json"
+
+    response = client.post("/cities/add_city", json={"city_name": "ListingCity", "latitude": 12.0, "longitude": 13.0})
+    assert response.status_code == 201
+
+    names = [city["city_name"] for city in client.get("/cities/cities").json()["cities"]]
+    assert "ListingCity" in names
+
+
+@pytest.mark.asyncio
+async def test_city_listing_survives_forecast_writes():
+    first = client.get("/cities/cities")
+    assert first.status_code == 200
+
+    async with database.writer() as db:
+        generation = await forecast_snapshot.bump_generation(db)
+        await db.commit()
+    await forecast_snapshot.publish_generation(generation)
+
+    app.dependency_overrides[get_database] = lambda: Database("/nonexistent/dir/weather.db")
+    try:
+        cached = client.get("/cities/cities")
+    finally:
+        app.dependency_overrides.clear()
+    assert cached.status_code == 200
+    assert cached.content == first.content
+
+
+@pytest.mark.asyncio
+async def test_conditional_get_returns_304_without_db():
+    first = client.get("/cities/cities")
+    etag = first.headers["etag"]
+    assert first.headers["cache-control"].startswith("max-age=")
+
+    app.dependency_overrides[get_database] = lambda: Database("/nonexistent/dir/weather.db")
+    try:
+        not_modified = client.get("/cities/SomeCity?time=10:00:00", headers={"If-None-Match": etag})
+    finally:
+        app.dependency_overrides.clear()
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+
+    response = client.post("/cities/add_city", json={"city_name": "EtagCity", "latitude": 14.0, "longitude": 15.0})
+    assert response.status_code == 201
+
+    changed = client.get("/cities/cities", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+
+
+@pytest.mark.asyncio
+async def test_add_city_reports_weather_status():
+    response = client.post("/cities/add_city", json={"city_name": "StatusCity", "latitude": 16.0, "longitude": 17.0})
+    assert response.status_code == 201
+    assert response.json()["weather_status"] in ("queued", "running", "done", "failed")
+
+    status = client.get("/cities/StatusCity/status")
+    assert status.status_code == 200
+    assert status.json()["weather_status"] == response.json()["weather_status"]
+    assert status.headers["cache-control"] == "no-store"
+    assert "etag" not in status.headers
+
+    assert client.get("/cities/NoSuchStatusCity/status").status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_import_cities_json_and_ndjson(monkeypatch):
+    import app.service as service
+    backfilled = []
+
+    async def fake_upd_locations_to_db(location_ids):
+        backfilled.append(list(location_ids))
+        return set(location_ids)
+
+    monkeypatch.setattr(service, "upd_locations_to_db", fake_upd_locations_to_db)
+    client.post("/cities/add_city", json={"city_name": "ImportExisting", "latitude": 20.0, "longitude": 21.0})
+    backfilled.clear()
+
+    response = client.post("/cities/import", json=[
+        {"city_name": "ImportA", "latitude": 22.0, "longitude": 23.0},
+        {"city_name": "ImportB", "latitude": 22.001, "longitude": 23.001},
+        {"city_name": "ImportA", "latitude": 24.0, "longitude": 25.0},
+        {"city_name": "ImportExisting", "latitude": 20.0, "longitude": 21.0},
+    ])
+    assert response.status_code == 201
+    assert response.json() == {"message": "Добавлено городов: 2.", "received": 4, "imported": 2, "skipped": 2, "locations": 1}
+    assert len(backfilled) == 1 and len(set(backfilled[0])) == 1
+
+    ndjson = b'{"city_name": "ImportC", "latitude": 26.0, "longitude": 27.0}\n\n{"city_name": "ImportA", "latitude": 22.0, "longitude": 23.0}\n'
+    response = client.post("/cities/import", content=ndjson, headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 201
+    assert response.json()["imported"] == 1
+
+    names = [city["city_name"] for city in client.get("/cities/cities").json()["cities"]]
+    assert names.count("ImportA") == 1 and "ImportB" in names and "ImportC" in names
+
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        async with db.execute("SELECT latitude FROM cities WHERE city_name = 'ImportA' AND user_id IS NULL") as cursor:
+            assert (await cursor.fetchone())[0] == 22.0
+
+
+@pytest.mark.asyncio
+async def test_import_cities_rejects_invalid_items():
+    response = client.post("/cities/import", json=[
+        {"city_name": "ImportBad", "latitude": 10.0, "longitude": 10.0},
+        {"city_name": "ImportBad2", "latitude": 100.0, "longitude": 10.0},
+    ])
+    assert response.status_code == 422
+    assert response.json()["errors"][0]["loc"][0] == 1
+
+    names = [city["city_name"] for city in client.get("/cities/cities").json()["cities"]]
+    assert "ImportBad" not in names
+
+    assert client.post("/cities/import?user_id=999999", json=[]).status_code == 404
+
+
+@pytest.mark.asyncio
+async def test_cities_batch_column_wise():
+    try:
+        user_id = client.post("/users/register", params={"name": "BatchUser"}).json()["id"]
+        location_ids = {}
+        for city_name, latitude in (("BatchA", 61.0), ("BatchB", 62.0), ("BatchC", 63.0)):
+            response = client.post(f"/cities/add_city?user_id={user_id}",
+                                   json={"city_name": city_name, "latitude": latitude, "longitude": 30.0})
+            assert response.status_code == 201, f"Ожидался статус 201, но получен {response.status_code}"
+            location_ids[city_name] = response.json()["city"]["city_id"]
+
+        async with aiosqlite.connect(DB_ROUTE) as db:
+            for city_name, city_id in location_ids.items():
+                async with db.execute("SELECT location_id FROM cities WHERE id = ?", (city_id,)) as cursor:
+                    location_ids[city_name] = (await cursor.fetchone())[0]
+            await db.executemany(
+                """
+                INSERT INTO weather_data
+                (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """,
+                [(location_ids[city_name], f"2025-02-01 10:{minute:02d}:00", offset + minute, 1000.0, 5.0, 0.0)
+                 for city_name, offset in (("BatchA", 0.0), ("BatchB", 100.0)) for minute in (0, 15, 30)]
+            )
+            await db.commit()
+
+        response = client.get(f"/cities/batch?user_id={user_id}&cities=BatchB&cities=BatchA&cities=Nowhere"
+                              "&date=2025-02-01&time=10:05:00&weather_params=temperature")
+        assert response.status_code == 200, f"Ожидался статус 200, но получен {response.status_code}"
+        assert response.json() == {
+            "city_name": ["BatchB", "BatchA"],
+            "time": "2025-02-01 10:05:00",
+            "temperature": [105.0, 5.0],
+            "missing": ["Nowhere"],
+        }
+
+        response = client.get(f"/cities/batch?user_id={user_id}&cities=all&date=2025-02-01"
+                              "&from=10:00&to=10:30&step=30&weather_params=temperature&weather_params=wind_speed")
+        assert response.status_code == 200, f"Ожидался статус 200, но получен {response.status_code}"
+        data = response.json()
+        assert data["city_name"] == ["BatchA", "BatchB", "BatchC"]
+        assert data["timestamp"] == ["2025-02-01 10:00:00", "2025-02-01 10:30:00"]
+        assert data["temperature"] == [[0.0, 30.0], [100.0, 130.0], [None, None]]
+        assert data["wind_speed"][0] == [5.0, 5.0]
+        assert data["missing"] == []
+
+        response = client.get("/cities/batch?user_id=999999&time=10:00:00")
+        assert response.status_code == 404, f"Ожидался статус 404, но получен {response.status_code}"
+        response = client.get(f"/cities/batch?user_id={user_id}&step=20")
+        assert response.status_code == 400, f"Ожидался статус 400, но получен {response.status_code}"
+    except Exception as e:
+        print(f"Ошибка в тесте 'test_cities_batch_column_wise': {e}")
+        raise
@@ -0,0 +1,26 @@
+import pytest
+
+from app import http_client
+
+
+@pytest.mark.asyncio
+async def test_shared_session_is_reused():
+    await http_client.start()
+    try:
+        async with http_client.session() as first:
+            pass
+        async with http_client.session() as second:
+            pass
+        assert first is second
+        assert not first.closed
+    finally:
+        await http_client.close()
+
+    assert first.closed
+
+
+@pytest.mark.asyncio
+async def test_temporary_session_without_lifespan():
+    async with http_client.session() as session:
+        assert not session.closed
+    assert session.closed
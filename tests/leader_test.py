@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+
+from app import snapshot
+from app.db import database
+from app.leader import LeaderLease
+from app.pubsub import forecast_updates
+
+
+@pytest.mark.asyncio
+async def test_single_leader_and_takeover():
+    first = LeaderLease("test_lease", ttl=30)
+    second = LeaderLease("test_lease", ttl=30)
+    await first.release()
+
+    assert await first.acquire() is True
+    assert await second.acquire() is False
+    assert await first.acquire() is True
+
+    async with database.writer() as db:
+        await db.execute("UPDATE leases SET expires_at = 0 WHERE name = 'test_lease'")
+        await db.commit()
+    assert await second.acquire() is True
+    assert await first.acquire() is False
+
+    await second.release()
+    assert second.is_leader is False
+    assert await first.acquire() is True
+    await first.release()
+
+
+async def write_other_worker_location(latitude, longitude):
+    """
+    Записывает локацию так, как это делает другой процесс: поколение в БД растёт,
+    а этот процесс о нём не знает
+    """
+    async with database.writer() as db:
+        await db.execute("INSERT OR IGNORE INTO locations (latitude, longitude) VALUES (?, ?)", (latitude, longitude))
+        generation = await snapshot.bump_generation(db)
+        await db.execute("UPDATE locations SET data_generation = ? WHERE latitude = ? AND longitude = ?",
+                         (generation, latitude, longitude))
+        async with db.execute("SELECT id FROM locations WHERE latitude = ? AND longitude = ?", (latitude, longitude)) as cursor:
+            location_id = (await cursor.fetchone())[0]
+        await db.commit()
+    return generation, location_id
+
+
+@pytest.mark.asyncio
+async def test_sync_generation_picks_up_other_worker_writes():
+    await snapshot.refresh_snapshot()
+    assert await snapshot.sync_generation() is False
+
+    generation, location_id = await write_other_worker_location(11.5, 22.5)
+    subscription = forecast_updates.subscribe([location_id])
+    try:
+        assert await snapshot.sync_generation() is True
+        assert await asyncio.wait_for(subscription.get(), 1) == (generation, frozenset([location_id]))
+    finally:
+        forecast_updates.unsubscribe(subscription)
+
+    assert snapshot.generation() == generation
+    assert snapshot.current().generation == generation
+    assert await snapshot.sync_generation() is False
+
+
+@pytest.mark.asyncio
+async def test_own_change_does_not_skip_unread_other_worker_writes():
+    await snapshot.refresh_snapshot()
+    _, location_id = await write_other_worker_location(11.6, 22.6)
+
+    subscription = forecast_updates.subscribe([location_id])
+    try:
+        async with database.writer() as db:
+            generation = await snapshot.bump_generation(db)
+            await db.commit()
+        await snapshot.publish_generation(generation)
+
+        assert snapshot.generation() == generation
+        _, location_ids = await asyncio.wait_for(subscription.get(), 1)
+        assert location_id in location_ids
+    finally:
+        forecast_updates.unsubscribe(subscription)
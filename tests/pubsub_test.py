@@ -0,0 +1,68 @@
+import json
+import asyncio
+
+import pytest
+
+from app.pubsub import Broker, forecast_updates
+from app.routes.cities import _forecast_events
+
+
+def parse_event(chunk):
+    lines = chunk.decode().strip().split("\n")
+    assert lines[0] == "event: forecast"
+    return json.loads(lines[2][len("data: "):])
+
+
+@pytest.mark.asyncio
+async def test_broker_routes_updates_by_location():
+    broker = Broker(buffer_size=4)
+    first = broker.subscribe([1, 2])
+    second = broker.subscribe([3])
+
+    broker.publish(5, [2, 7])
+    assert await first.get() == (5, frozenset({2}))
+    assert second._queue.empty()
+
+    broker.publish(6)
+    assert await first.get() == (6, None)
+    assert await second.get() == (6, None)
+
+    broker.unsubscribe(first)
+    broker.publish(7, [1, 2, 3])
+    assert first._queue.empty()
+    assert await second.get() == (7, frozenset({3}))
+    assert broker.stats() == {"subscribers": 1, "locations": 1, "dropped": 0}
+
+
+@pytest.mark.asyncio
+async def test_slow_subscriber_buffer_is_bounded():
+    broker = Broker(buffer_size=2)
+    subscription = broker.subscribe([1])
+
+    for generation in range(1, 6):
+        broker.publish(generation, [1])
+
+    assert subscription._queue.qsize() == 1
+    assert await subscription.get() == (5, None)
+    assert subscription.dropped == 4
+
+
+@pytest.mark.asyncio
+async def test_forecast_events_stream_deltas():
+    locations = {"StreamA": 901, "StreamB": 902}
+    subscription = forecast_updates.subscribe(locations.values())
+    events = _forecast_events(subscription, locations, ["temperature"], keepalive=0.05)
+
+    initial = parse_event(await events.__anext__())
+    assert initial["city_name"] == ["StreamA", "StreamB"]
+    assert initial["temperature"] == [None, None]
+
+    assert await events.__anext__() == b": keepalive\n\n"
+
+    forecast_updates.publish(42, [902])
+    delta = parse_event(await asyncio.wait_for(events.__anext__(), 1))
+    assert delta["generation"] == 42
+    assert delta["city_name"] == ["StreamB"]
+
+    await events.aclose()
+    assert subscription not in forecast_updates._subscriptions
@@ -0,0 +1,61 @@
+from datetime import date
+
+import pytest
+import aiosqlite
+from fastapi.testclient import TestClient
+
+from app.db import get_or_create_location
+from app.retention import compact_weather_data
+from conftest import DB_ROUTE
+from script import app
+
+
+client = TestClient(app)
+
+
+@pytest.mark.asyncio
+async def test_compaction_downsamples_old_days_to_hourly():
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        location_id = await get_or_create_location(db, 81.0, 82.0)
+        await db.execute("INSERT INTO cities (city_name, latitude, longitude, location_id) VALUES ('OldCity', 81.0, 82.0, ?)",
+                         (location_id,))
+        await db.executemany(
+            '''INSERT INTO weather_data (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+               VALUES (?, ?, ?, 1000.0, 5.0, 0.5)''',
+            [(location_id, f"2024-01-01 10:{minute:02d}:00", float(minute)) for minute in (0, 15, 30, 45)]
+            + [(location_id, "2024-03-01 10:00:00", 1.0)]
+        )
+        await db.commit()
+
+    stats = await compact_weather_data(today=date(2024, 2, 1))
+    assert stats["raw_deleted"] >= 4
+
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        async with db.execute("SELECT timestamp, temperature, precipitation FROM weather_hourly WHERE location_id = ?",
+                              (location_id,)) as cursor:
+            assert await cursor.fetchall() == [("2024-01-01 10:00:00", 22.5, 2.0)]
+        async with db.execute("SELECT timestamp FROM weather_data WHERE location_id = ?", (location_id,)) as cursor:
+            assert await cursor.fetchall() == [("2024-03-01 10:00:00",)]
+
+    response = client.get("/cities/OldCity?date=2024-01-01&weather_params=temperature")
+    assert response.status_code == 200
+    assert response.json()["temperature"] == [22.5]
+
+
+@pytest.mark.asyncio
+async def test_compaction_returns_free_pages():
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        location_id = await get_or_create_location(db, 83.0, 84.0)
+        await db.executemany(
+            '''INSERT INTO weather_data (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+               VALUES (?, ?, 1.0, 1000.0, 5.0, 0.5)''',
+            [(location_id, f"2023-{month:02d}-{day:02d} {hour:02d}:{minute:02d}:00")
+             for month in (1, 2) for day in range(1, 29) for hour in range(24) for minute in (0, 15, 30, 45)]
+        )
+        await db.commit()
+
+    await compact_weather_data(today=date(2024, 2, 1))
+
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        async with db.execute("PRAGMA freelist_count") as cursor:
+            assert (await cursor.fetchone())[0] == 0
@@ -0,0 +1,286 @@
+import time
+import asyncio
+import json
+from datetime import date
+
+import pytest
+import aiosqlite
+
+import app.service as service
+from app.db import get_or_create_location
+from app.ingest import IngestProcess
+from app.storage import STORAGES
+from conftest import DB_ROUTE, make_forecast_payload
+
+
+async def add_cities(*cities):
+    """
+    Добавляет города (city_name, latitude, longitude) и возвращает id их локаций
+    """
+    ids = []
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        for city_name, latitude, longitude in cities:
+            location_id = await get_or_create_location(db, latitude, longitude)
+            await db.execute("INSERT INTO cities (city_name, latitude, longitude, location_id) VALUES (?, ?, ?, ?)",
+                             (city_name, latitude, longitude, location_id))
+            ids.append(location_id)
+        await db.commit()
+    return ids
+
+
+@pytest.mark.asyncio
+async def test_upd_data_to_db_isolates_city_failures(monkeypatch):
+    ok_id, fail_id = await add_cities(("RefreshOk", 10.0, 10.0), ("RefreshFail", -10.0, -10.0))
+
+    async def fake_get_weather(params):
+        if float(params['latitude']) < 0:
+            raise RuntimeError("upstream down")
+        return json.dumps(make_forecast_payload()).encode()
+
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+    monkeypatch.setattr(service, "REFRESH_BATCH_SIZE", 1)
+    await service.upd_data_to_db()
+
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        async with db.execute("SELECT COUNT(*) FROM weather_data WHERE location_id = ?", (ok_id,)) as cursor:
+            assert (await cursor.fetchone())[0] == 96
+        async with db.execute("SELECT COUNT(*) FROM weather_data WHERE location_id = ?", (fail_id,)) as cursor:
+            assert (await cursor.fetchone())[0] == 0
+
+
+@pytest.mark.asyncio
+async def test_fetch_cities_weather_splits_batch_response(monkeypatch):
+    calls = []
+
+    async def fake_get_weather(params):
+        calls.append(params)
+        latitudes = params['latitude'].split(',')
+        return json.dumps([make_forecast_payload(temperature=float(latitude)) for latitude in latitudes]).encode()
+
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+    forecasts = await service.fetch_locations_weather([(1, 11.0, 1.0), (2, 22.0, 2.0)])
+
+    assert len(calls) == 1
+    assert calls[0]['latitude'] == "11.0,22.0"
+    assert [location_id for location_id, _ in forecasts] == [1, 2]
+    assert forecasts[1][1]['minutely_15']['temperature_2m'][0] == 22.0
+
+
+@pytest.mark.asyncio
+async def test_cities_with_same_coordinates_share_location(monkeypatch):
+    location_ids = await add_cities(("SharedA", 33.333, 44.444), ("SharedB", 33.3331, 44.4442), ("SharedC", 33.333, 44.444))
+    assert len(set(location_ids)) == 1
+
+    calls = []
+
+    async def fake_get_weather(params):
+        calls.append(params)
+        return json.dumps(make_forecast_payload()).encode()
+
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+    await service.upd_data_to_db("SharedA")
+    await service.upd_data_to_db("SharedB")
+
+    assert [params['latitude'] for params in calls] == ["33.33", "33.33"]
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        async with db.execute("SELECT COUNT(*) FROM weather_data WHERE location_id = ?", (location_ids[0],)) as cursor:
+            assert (await cursor.fetchone())[0] == 96
+
+
+def test_build_weather_rows_formats_timestamps():
+    rows = service.build_weather_rows(7, make_forecast_payload(day=date(2025, 1, 1)))
+
+    assert len(rows) == 96
+    assert rows[40] == (7, "2025-01-01 10:00:00", 24.0, 1000.0, 5.0, 0.0)
+
+
+@pytest.mark.asyncio
+async def test_refresh_writes_only_changed_slots(monkeypatch):
+    await add_cities(("DiffCity", 71.0, 72.0))
+    payload = make_forecast_payload()
+
+    async def fake_get_weather(params):
+        return json.dumps(payload).encode()
+
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+
+    first = await service.upd_data_to_db("DiffCity")
+    assert first['rows_written'] == 96
+
+    second = await service.upd_data_to_db("DiffCity")
+    assert second['rows_written'] == 0
+    assert second['locations_skipped'] == 1
+
+    payload['minutely_15']['temperature_2m'][5] = -40.0
+    third = await service.upd_data_to_db("DiffCity")
+    assert third['rows_written'] == 1
+    assert third['rows_skipped'] == 95
+
+
+@pytest.mark.asyncio
+async def test_write_location_weather_leaves_commit_to_caller():
+    location_id, = await add_cities(("RollbackCity", 73.0, 74.0))
+
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        written, _ = await service.write_location_weather(db, location_id, make_forecast_payload())
+        assert written == 96
+        assert db.in_transaction
+        await db.rollback()
+
+        async with db.execute("SELECT COUNT(*) FROM weather_data WHERE location_id = ?", (location_id,)) as cursor:
+            assert (await cursor.fetchone())[0] == 0
+        async with db.execute("SELECT forecast_hash FROM locations WHERE id = ?", (location_id,)) as cursor:
+            assert (await cursor.fetchone())[0] is None
+
+
+@pytest.mark.asyncio
+async def test_storage_switch_rewrites_unchanged_forecast(monkeypatch):
+    location_id, = await add_cities(("SwitchCity", 75.0, 76.0))
+    payload = make_forecast_payload()
+
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        monkeypatch.setattr(service, "storage", STORAGES["rows"])
+        assert (await service.write_location_weather(db, location_id, payload))[0] == 96
+        await db.commit()
+
+        monkeypatch.setattr(service, "storage", STORAGES["columnar"])
+        assert (await service.write_location_weather(db, location_id, payload))[0] == 96
+        await db.commit()
+        series = await STORAGES["columnar"].read_day(db, date.today(), [location_id])
+        assert location_id in series
+
+
+@pytest.mark.asyncio
+async def test_refresh_rejects_malformed_forecast(monkeypatch):
+    location_id, = await add_cities(("MalformedCity", 73.0, 74.0))
+    payload = make_forecast_payload()
+    del payload['minutely_15']['wind_speed_10m']
+
+    async def fake_get_weather(params):
+        return json.dumps(payload).encode()
+
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+    stats = await service.upd_data_to_db("MalformedCity")
+
+    assert stats['locations_failed'] == 1
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        async with db.execute("SELECT COUNT(*) FROM weather_data WHERE location_id = ?", (location_id,)) as cursor:
+            assert (await cursor.fetchone())[0] == 0
+
+
+@pytest.mark.asyncio
+async def test_upd_locations_to_db_fetches_only_given_locations(monkeypatch):
+    new_id, other_id = await add_cities(("Twin", 75.0, 76.0), ("Twin", 77.0, 78.0))
+    calls = []
+
+    async def fake_get_weather(params):
+        calls.append(params)
+        return json.dumps(make_forecast_payload()).encode()
+
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+    stored = await service.upd_locations_to_db([new_id])
+
+    assert stored == {new_id}
+    assert [params['latitude'] for params in calls] == ["75.0"]
+
+
+def test_next_due_spreads_shards_over_interval(monkeypatch):
+    monkeypatch.setattr(service, "REFRESH_TIME", 15)
+    monkeypatch.setattr(service, "REFRESH_SHARDS", 15)
+    now = 1_700_000_000.0
+
+    due = [service.next_due(location_id, now) for location_id in range(15)]
+
+    assert all(now < moment <= now + 15 * 60 for moment in due)
+    assert sorted(moment % 60 for moment in due) == [due[0] % 60] * 15
+    assert len({int(moment // 60) for moment in due}) == 15
+    assert service.next_due(16, due[1]) == due[1] + 15 * 60
+
+
+@pytest.mark.asyncio
+async def test_refresh_due_locations_skips_not_due(monkeypatch):
+    due_id, later_id = await add_cities(("DueCity", 81.0, 82.0), ("LaterCity", 83.0, 84.0))
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        await db.execute("UPDATE locations SET next_due_at = NULL WHERE id IN (SELECT location_id FROM cities)")
+        await db.execute("UPDATE locations SET next_due_at = ? WHERE id = ?", (time.time() + 600, later_id))
+        await db.commit()
+    calls = []
+
+    async def fake_get_weather(params):
+        calls.append(params['latitude'])
+        return json.dumps([make_forecast_payload()] * len(params['latitude'].split(','))).encode()
+
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+    first = await service.refresh_due_locations()
+    second = await service.refresh_due_locations()
+
+    assert "83.0" not in ",".join(calls)
+    assert "81.0" in calls[0].split(',')
+    assert first['locations_failed'] == 0
+    assert second is None
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        async with db.execute("SELECT next_due_at FROM locations WHERE id = ?", (due_id,)) as cursor:
+            assert (await cursor.fetchone())[0] > time.time()
+
+
+@pytest.mark.asyncio
+async def test_refresh_in_ingest_process(monkeypatch):
+    good_id, bad_id = await add_cities(("IngestGood", 85.0, 86.0), ("IngestBad", -85.0, -86.0))
+    payload = make_forecast_payload()
+    malformed = make_forecast_payload()
+    del malformed['minutely_15']['precipitation']
+
+    async def fake_get_weather(params):
+        return json.dumps(malformed if float(params['latitude']) < 0 else payload).encode()
+
+    process = IngestProcess(DB_ROUTE)
+    await process.start()
+    monkeypatch.setattr(service, "ingest", process)
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+    monkeypatch.setattr(service, "REFRESH_BATCH_SIZE", 1)
+    try:
+        stored = await service.upd_locations_to_db([good_id, bad_id])
+        stats = service.last_refresh_stats.copy()
+        again = await service.upd_locations_to_db([good_id])
+    finally:
+        await process.close()
+
+    assert stored == {good_id}
+    assert again == {good_id}
+    assert stats['rows_written'] == 96
+    assert stats['locations_failed'] == 1
+    assert service.last_refresh_stats['locations_skipped'] == 1
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        async with db.execute("SELECT COUNT(*) FROM weather_data WHERE location_id = ?", (good_id,)) as cursor:
+            assert (await cursor.fetchone())[0] == 96
+
+
+@pytest.mark.asyncio
+async def test_refresh_survives_failed_commit(monkeypatch):
+    location_ids = await add_cities(*((f"CommitFail{index}", 40.0 + index / 10, 41.0) for index in range(40)))
+
+    async def fake_get_weather(params):
+        return json.dumps(make_forecast_payload()).encode()
+
+    async def failing_commit(self):
+        raise aiosqlite.OperationalError("database is locked")
+
+    monkeypatch.setattr(service, "get_weather", fake_get_weather)
+    monkeypatch.setattr(service, "REFRESH_BATCH_SIZE", 1)
+    monkeypatch.setattr(aiosqlite.Connection, "commit", failing_commit)
+
+    stored = await asyncio.wait_for(service.upd_locations_to_db(location_ids), 10)
+
+    assert stored == set()
+    assert service.last_refresh_stats['locations_failed'] == 40
+    assert service.last_refresh_stats['rows_written'] == 0
+
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        placeholders = ",".join("?" * len(location_ids))
+        async with db.execute(f"SELECT COUNT(*) FROM weather_data WHERE location_id IN ({placeholders})",
+                              location_ids) as cursor:
+            assert (await cursor.fetchone())[0] == 0
+        async with db.execute(f"""SELECT COUNT(*) FROM locations WHERE id IN ({placeholders})
+                                  AND (forecast_hash IS NOT NULL OR data_generation != 0)""",
+                              location_ids) as cursor:
+            assert (await cursor.fetchone())[0] == 0
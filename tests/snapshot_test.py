@@ -0,0 +1,70 @@
+import asyncio
+from datetime import date
+
+import pytest
+import aiosqlite
+from fastapi.testclient import TestClient
+
+from app import snapshot, storage
+from app.db import Database, get_database, get_or_create_location
+from conftest import DB_ROUTE
+from script import app
+
+
+client = TestClient(app)
+
+
+def test_time_to_slot():
+    assert storage.time_to_slot("00:00:00") == 0
+    assert storage.time_to_slot("10:15:00") == 41
+    assert storage.time_to_slot("10:07:00") is None
+    assert storage.time_to_slot("invalid") is None
+
+
+@pytest.mark.asyncio
+async def test_city_weather_served_from_snapshot_without_db():
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        location_id = await get_or_create_location(db, 61.0, 62.0)
+        await db.execute("INSERT INTO cities (city_name, latitude, longitude, location_id) VALUES ('SnapshotCity', 61.0, 62.0, ?)",
+                         (location_id,))
+        await db.executemany('''INSERT INTO weather_data (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+                                VALUES (?, ?, ?, 990.0, 3.0, 0.5)''',
+                             [(location_id, f"{date.today()} 10:15:00", 7.5), (location_id, f"{date.today()} 10:30:00", 9.0)])
+        await db.commit()
+
+    published = await snapshot.refresh_snapshot()
+    assert snapshot.current() is published
+    assert published.location_id(None, "SnapshotCity") == location_id
+
+    app.dependency_overrides[get_database] = lambda: Database("/nonexistent/dir/weather.db")
+    try:
+        response = client.get("/cities/SnapshotCity?time=10:15:00&weather_params=temperature&weather_params=wind_speed")
+        interpolated = client.get("/cities/SnapshotCity?time=10:20:00&weather_params=temperature")
+    finally:
+        app.dependency_overrides.clear()
+
+    assert response.status_code == 200
+    assert response.json() == {"temperature": 7.5, "wind_speed": 3.0}
+    assert interpolated.status_code == 200
+    assert interpolated.json() == {"temperature": 8.0}
+
+
+@pytest.mark.asyncio
+async def test_overlapping_partial_refreshes_keep_both_updates():
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        first = await get_or_create_location(db, 63.0, 64.0)
+        second = await get_or_create_location(db, 65.0, 66.0)
+        await db.executemany('''INSERT INTO weather_data (location_id, timestamp, temperature, surface_pressure, wind_speed, precipitation)
+                                VALUES (?, ?, 1.0, 990.0, 3.0, 0.5)''',
+                             [(first, f"{date.today()} 10:00:00"), (second, f"{date.today()} 10:00:00")])
+        await db.commit()
+    await snapshot.refresh_snapshot()
+
+    async with aiosqlite.connect(DB_ROUTE) as db:
+        await db.execute("UPDATE weather_data SET temperature = 99.0 WHERE location_id IN (?, ?)", (first, second))
+        await db.commit()
+    await asyncio.gather(snapshot.refresh_snapshot([first]), snapshot.refresh_snapshot([second]))
+
+    current = snapshot.current()
+    assert current.values(first, 40, ["temperature"]) == {"temperature": 99.0}
+    assert current.values(second, 40, ["temperature"]) == {"temperature": 99.0}
@@ -0,0 +1,78 @@
+import math
+from datetime import date, datetime
+
+import pytest
+import aiosqlite
+
+from app.db import init_db
+from app.service import build_weather_rows
+from app.storage import STORAGES, WeatherStorage
+from conftest import make_forecast_payload
+
+
+@pytest.fixture(params=sorted(STORAGES))
+def storage(request):
+    return STORAGES[request.param]
+
+
+@pytest.mark.asyncio
+async def test_storage_round_trip(storage, tmp_path):
+    db_route = str(tmp_path / f"{storage.name}.db")
+    await init_db(db_route)
+    day = date(2025, 1, 1)
+    rows = build_weather_rows(1, make_forecast_payload(day=day))
+
+    async with aiosqlite.connect(db_route) as db:
+        await db.execute("INSERT INTO locations (id, latitude, longitude) VALUES (1, 0.0, 0.0)")
+        assert await storage.write(db, 1, rows) == (96, 0)
+        assert await storage.write(db, 1, rows) == (0, 96)
+
+        changed = [row[:2] + (-5.5,) + row[3:] if row[1] == "2025-01-01 10:00:00" else row for row in rows]
+        assert await storage.write(db, 1, changed) == (1, 95)
+
+        records = await storage.read_range(db, 1, datetime(2025, 1, 1, 10), datetime(2025, 1, 1, 10, 30), ["temperature", "wind_speed"])
+        assert records == [
+            ("2025-01-01 10:00:00", -5.5, 5.0),
+            ("2025-01-01 10:15:00", 24.1, 5.0),
+            ("2025-01-01 10:30:00", 24.2, 5.0),
+        ]
+        many = await storage.read_range_many(db, [1, 2], datetime(2025, 1, 1, 10), datetime(2025, 1, 1, 10, 30), ["temperature", "wind_speed"])
+        assert many == {1: records}
+
+        series = await storage.read_day(db, day)
+        assert list(series) == [1]
+        assert series[1]["temperature"][40] == pytest.approx(-5.5)
+        assert series[1]["precipitation"][95] == 0.0
+        assert await storage.read_day(db, date(2025, 1, 2)) == {}
+
+        hourly_rows, deleted = await storage.compact(db, "2025-01-02 00:00:00")
+        assert hourly_rows == 24 and deleted >= 1
+        assert await storage.read_range(db, 1, datetime(2025, 1, 1), datetime(2025, 1, 2), ["temperature"]) == []
+        hourly = await storage.read_hourly_range(db, 1, datetime(2025, 1, 1, 10), datetime(2025, 1, 1, 10), ["temperature"])
+        assert hourly[0][0] == "2025-01-01 10:00:00"
+        assert hourly[0][1] == pytest.approx((-5.5 + 24.1 + 24.2 + 24.3) / 4, abs=0.01)
+        hourly_many = await storage.read_hourly_range_many(db, [1, 2], datetime(2025, 1, 1, 10), datetime(2025, 1, 1, 10), ["temperature"])
+        assert hourly_many == {1: [tuple(record) for record in hourly]}
+
+
+@pytest.mark.asyncio
+async def test_columnar_storage_keeps_slots_missing_from_update(tmp_path):
+    db_route = str(tmp_path / "partial.db")
+    await init_db(db_route)
+    storage = STORAGES["columnar"]
+    rows = build_weather_rows(1, make_forecast_payload(day=date(2025, 1, 1)))
+
+    async with aiosqlite.connect(db_route) as db:
+        await storage.write(db, 1, rows)
+        await storage.write(db, 1, rows[:10])
+        series = await storage.read_day(db, date(2025, 1, 1))
+        assert not math.isnan(series[1]["temperature"][95])
+
+
+def test_storage_without_required_methods_cannot_be_created():
+    class PartialStorage(WeatherStorage):
+        async def write(self, db, location_id, rows):
+            return 0, 0
+
+    with pytest.raises(TypeError):
+        PartialStorage()
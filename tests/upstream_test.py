@@ -0,0 +1,203 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+from fastapi.testclient import TestClient
+
+from app.routes import weather
+from app.upstream import (UpstreamClient, TokenBucket, CircuitBreaker, CircuitOpenError,
+                          UpstreamStatusError, UpstreamUnavailableError)
+from script import app
+
+
+client = TestClient(app)
+
+
+async def start_stub(statuses):
+    """
+    Локальный сервер вместо api.open-meteo.com: отвечает статусами из statuses по очереди
+    (последний повторяется) и считает запросы
+    """
+    calls = []
+
+    async def forecast(request):
+        calls.append(dict(request.query))
+        status = statuses[min(len(calls), len(statuses)) - 1]
+        if status != 200:
+            return web.json_response({"reason": "stub"}, status=status)
+        return web.json_response({"current": {"temperature_2m": 3.0, "wind_speed_10m": 4.0, "surface_pressure": 990.0}})
+
+    stub = web.Application()
+    stub.router.add_get("/v1/forecast", forecast)
+    server = TestServer(stub)
+    await server.start_server()
+    return server, calls
+
+
+def make_client(url, retries=2, failure_threshold=5, reset_timeout=30.0):
+    return UpstreamClient(str(url), TokenBucket(1000, 1000), CircuitBreaker(failure_threshold, reset_timeout),
+                          retries, backoff_base=0.001, backoff_max=0.01)
+
+
+@pytest.mark.asyncio
+async def test_upstream_retries_transient_errors():
+    server, calls = await start_stub([503, 500, 200])
+    try:
+        upstream = make_client(server.make_url("/v1/forecast"))
+        body = await upstream.get({"latitude": 1})
+    finally:
+        await server.close()
+
+    assert json.loads(body)["current"]["temperature_2m"] == 3.0
+    assert len(calls) == 3
+    assert upstream.stats()["retried"] == 2
+    assert upstream.breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_upstream_does_not_retry_client_errors():
+    server, calls = await start_stub([400])
+    try:
+        upstream = make_client(server.make_url("/v1/forecast"))
+        with pytest.raises(UpstreamStatusError) as error:
+            await upstream.get({"latitude": 1000})
+    finally:
+        await server.close()
+
+    assert error.value.status == 400 and not error.value.transient
+    assert len(calls) == 1
+
+
+@pytest.mark.asyncio
+async def test_circuit_breaker_fails_fast_and_recovers():
+    server, calls = await start_stub([500, 500, 200])
+    try:
+        upstream = make_client(server.make_url("/v1/forecast"), retries=0, failure_threshold=2, reset_timeout=0.05)
+        for _ in range(2):
+            with pytest.raises(UpstreamStatusError):
+                await upstream.get({})
+        assert upstream.breaker.state == "open"
+
+        with pytest.raises(CircuitOpenError):
+            await upstream.get({})
+        assert len(calls) == 2
+
+        await asyncio.sleep(0.06)
+        assert upstream.breaker.state == "half_open"
+        await upstream.get({})
+    finally:
+        await server.close()
+
+    assert upstream.breaker.state == "closed"
+    assert upstream.stats()["rejected"] == 1
+
+
+@pytest.mark.asyncio
+async def test_cancelled_trial_does_not_wedge_breaker(monkeypatch):
+    upstream = make_client("http://127.0.0.1:1/v1/forecast", retries=0, failure_threshold=1, reset_timeout=0.01)
+    upstream.breaker.record_failure()
+    await asyncio.sleep(0.02)
+    assert upstream.breaker.state == "half_open"
+
+    started = asyncio.Event()
+
+    async def hanging_attempt(params):
+        started.set()
+        await asyncio.sleep(10)
+
+    monkeypatch.setattr(upstream, "_attempt", hanging_attempt)
+    trial = asyncio.create_task(upstream.get({}))
+    await started.wait()
+    trial.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await trial
+
+    async def ok_attempt(params):
+        return b"{}", None
+
+    monkeypatch.setattr(upstream, "_attempt", ok_attempt)
+    assert await upstream.get({}) == b"{}"
+    assert upstream.breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_only_trial_holder_releases_trial(monkeypatch):
+    upstream = make_client("http://127.0.0.1:1/v1/forecast", retries=0, failure_threshold=1, reset_timeout=0.01)
+    release = asyncio.Event()
+    started = asyncio.Event()
+    calls = []
+
+    async def attempt(params):
+        calls.append(params)
+        if params.get("slow"):
+            started.set()
+            await release.wait()
+        return b"{}", None
+
+    monkeypatch.setattr(upstream, "_attempt", attempt)
+    slow = asyncio.create_task(upstream.get({"slow": True}))
+    await started.wait()
+
+    upstream.breaker.record_failure()
+    await asyncio.sleep(0.02)
+    assert upstream.breaker.state == "half_open"
+
+    started.clear()
+    trial = asyncio.create_task(upstream.get({"slow": True}))
+    await started.wait()
+    slow.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await slow
+
+    with pytest.raises(CircuitOpenError):
+        await upstream.get({})
+    release.set()
+    await trial
+    assert len(calls) == 2
+    assert upstream.breaker.state == "closed"
+
+
+@pytest.mark.asyncio
+async def test_upstream_unreachable_raises_unavailable():
+    server, _ = await start_stub([200])
+    url = server.make_url("/v1/forecast")
+    await server.close()
+
+    upstream = make_client(url, retries=1)
+    with pytest.raises(UpstreamUnavailableError):
+        await upstream.get({})
+    assert upstream.stats()["failures"] == 2
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_limits_rate():
+    bucket = TokenBucket(rate=100, burst=2)
+    started = time.monotonic()
+    await asyncio.gather(*(bucket.acquire() for _ in range(6)))
+    assert time.monotonic() - started >= 0.035
+
+
+@pytest.mark.asyncio
+async def test_current_weather_served_stale_while_circuit_open(monkeypatch):
+    responses = [json.dumps({'current': {'temperature_2m': 5.0, 'wind_speed_10m': 1.0, 'surface_pressure': 1010.0}}).encode()]
+
+    async def fake_get_weather(params):
+        if responses:
+            return responses.pop()
+        raise CircuitOpenError("Weather service circuit is open")
+
+    monkeypatch.setattr(weather, "get_weather", fake_get_weather)
+    monkeypatch.setattr(weather.current_weather_cache, "ttl", 0)
+
+    fresh = await asyncio.to_thread(client.get, '/weather/current?latitude=33.21&longitude=44.32')
+    stale = await asyncio.to_thread(client.get, '/weather/current?latitude=33.21&longitude=44.32')
+    missing = await asyncio.to_thread(client.get, '/weather/current?latitude=-33.21&longitude=-44.32')
+
+    assert fresh.status_code == stale.status_code == 200
+    assert stale.json() == fresh.json()
+    assert stale.headers["x-cache-status"] == "stale"
+    assert missing.status_code == 500
+    assert "circuit is open" in missing.json()["message"]
@@ -1,8 +1,10 @@
+import json
 import asyncio
 
 import pytest
 from fastapi.testclient import TestClient
 
+from app.routes import weather
 from script import app
 
 client = TestClient(app)
@@ -47,3 +49,25 @@ async def test_get_weather_out_of_bounds_coordinates():
     assert response.status_code == 500
     assert "message" in response.json()
 
+
+
+@pytest.mark.asyncio
+async def test_get_weather_served_from_cache(monkeypatch):
+    calls = []
+
+    async def fake_get_weather(params):
+        calls.append(params)
+        return json.dumps({'current': {'temperature_2m': 1.5, 'wind_speed_10m': 2.5, 'surface_pressure': 1000.0}}).encode()
+
+    monkeypatch.setattr(weather, "get_weather", fake_get_weather)
+
+    first = await asyncio.to_thread(client.get, '/weather/current?latitude=12.3401&longitude=45.6701')
+    second = await asyncio.to_thread(client.get, '/weather/current?latitude=12.3399&longitude=45.6699')
+
+    assert first.status_code == second.status_code == 200
+    assert second.json() == {'temperature': 1.5, 'wind_speed': 2.5, 'surface_pressure': 1000.0}
+    assert len(calls) == 1
+    assert calls[0]['latitude'] == 12.34
+
+    stats = client.get('/weather/cache_stats').json()
+    assert stats['hits'] >= 1